@@ -0,0 +1,198 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import os
+import gzip
+import json
+import time
+import asyncio
+import sqlite3
+import traceback
+
+import source
+from ticket import ticket_to_data
+
+
+class TicketArchive:
+    """
+    Append-only cold storage of closed tickets.
+
+    Tickets are written in batches, every batch as one gzip member appended to
+    the current segment file, a new segment is started once it grows past
+    segment_size bytes. A sqlite index maps guild and channel (and guild and
+    author or category) to the member holding the record. Restoring a ticket only removes it
+    from the index, its record stays in the segment.
+
+    Methods block, run them through run() to keep them off the event loop.
+    """
+    directory: str
+    segment_size: int
+    segment: int  # Number of the segment written to
+    archived: int
+    restored: int
+
+    def __init__(self, directory: str = "archive", segment_size: int = 4 * 1024 * 1024):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="archive")
+        self.connection = None
+        self.segment = 0
+        self.archived = 0
+        self.restored = 0
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(self.directory, "index.db"), check_same_thread=False)
+        with self.connection:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS archived (
+                    guild_id INTEGER NOT NULL,
+                    channel_id INTEGER NOT NULL,
+                    author_id INTEGER NOT NULL,
+                    category TEXT,
+                    closed_at REAL NOT NULL,
+                    segment INTEGER NOT NULL,
+                    offset INTEGER NOT NULL,
+                    length INTEGER NOT NULL,
+                    PRIMARY KEY (guild_id, channel_id)
+                );
+                CREATE INDEX IF NOT EXISTS archived_author ON archived (guild_id, author_id);
+            """)
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(archived)")]
+            if "category" not in columns:
+                self.connection.execute("ALTER TABLE archived ADD COLUMN category TEXT")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS archived_category ON archived (guild_id, category)")
+        segments = [int(name[8:-3]) for name in os.listdir(self.directory) if name.startswith("segment-")]
+        self.segment = max(segments, default=1)
+
+    async def run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"segment-{segment:06d}.gz")
+
+    def write(self, records: List[Dict[str, Any]]):
+        """ Appends ticket records and indexes them, replaces earlier archived copies """
+        path = self.segment_path(self.segment)
+        if os.path.exists(path) and os.path.getsize(path) >= self.segment_size:
+            self.segment += 1
+            path = self.segment_path(self.segment)
+        member = gzip.compress(b"".join((json.dumps(record) + "\n").encode() for record in records))
+        with open(path, "ab") as file:
+            offset = file.tell()
+            file.write(member)
+            file.flush()
+            os.fsync(file.fileno())
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO archived (guild_id, channel_id, author_id, category, closed_at, segment, "
+                "offset, length) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(r["guild_id"], r["channel_id"], r["author_id"], r["category"], r["updated_at"], self.segment, offset,
+                  len(member)) for r in records]
+            )
+        self.archived += len(records)
+
+    def read(self, guild_id: int, channel_id: int) -> Optional[Dict[str, Any]]:
+        row = self.connection.execute(
+            "SELECT segment, offset, length FROM archived WHERE guild_id = ? AND channel_id = ?",
+            [guild_id, channel_id]
+        ).fetchone()
+        if row is None:
+            return None
+        segment, offset, length = row
+        with open(self.segment_path(segment), "rb") as file:
+            file.seek(offset)
+            member = file.read(length)
+        for line in gzip.decompress(member).splitlines():
+            record = json.loads(line)
+            if record["guild_id"] == guild_id and record["channel_id"] == channel_id:
+                return record
+        return None
+
+    def contains(self, guild_id: int, channel_id: int) -> bool:
+        return self.connection.execute(
+            "SELECT 1 FROM archived WHERE guild_id = ? AND channel_id = ?", [guild_id, channel_id]
+        ).fetchone() is not None
+
+    def count(self, guild_id: int, author_id: Optional[int] = None, category: Optional[str] = None) -> int:
+        """ Archived tickets of the guild matching all given filters """
+        where = "guild_id = ?"
+        args = [guild_id]
+        if author_id is not None:
+            where += " AND author_id = ?"
+            args.append(author_id)
+        if category is not None:
+            where += " AND category = ?"
+            args.append(category)
+        return self.connection.execute(f"SELECT COUNT(*) FROM archived WHERE {where}", args).fetchone()[0]
+
+    def drop(self, guild_id: int, channel_id: int):
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM archived WHERE guild_id = ? AND channel_id = ?", [guild_id, channel_id])
+        self.restored += 1
+
+    def find(self, guild_id: int, author_id: Optional[int] = None) -> List[Tuple[int, int, float]]:
+        """ (channel ID, author ID, closed at) of archived tickets of the guild """
+        if author_id is None:
+            return self.connection.execute(
+                "SELECT channel_id, author_id, closed_at FROM archived WHERE guild_id = ?", [guild_id]).fetchall()
+        return self.connection.execute(
+            "SELECT channel_id, author_id, closed_at FROM archived WHERE guild_id = ? AND author_id = ?",
+            [guild_id, author_id]
+        ).fetchall()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        if self.connection is not None:
+            self.connection.close()
+
+
+class Archiver:
+    """
+    Moves tickets closed for longer than max_age seconds out of memory and the
+    data source into the archive. Candidates come from the front of the registry
+    closed activity order, so a run only visits the tickets it moves.
+    """
+    client: Any  # TicketBot
+    archive: TicketArchive
+    max_age: float
+    interval: float
+    batch_size: int
+
+    def __init__(self, client, archive: TicketArchive, max_age: float, interval: float = 3600, batch_size: int = 500):
+        self.client = client
+        self.archive = archive
+        self.max_age = max_age
+        self.interval = interval
+        self.batch_size = batch_size
+
+    async def loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            for guild_id in list(self.client.hydrated):
+                try:
+                    await self.archive_guild(guild_id)
+                except Exception:
+                    print(f"Failed to archive tickets of guild {guild_id}:")
+                    traceback.print_exc()
+
+    async def archive_guild(self, guild_id: int) -> int:
+        deadline = time.time() - self.max_age
+        stale = self.client.tickets.least_active(guild_id, before=deadline, is_open=False)
+        for i in range(0, len(stale), self.batch_size):
+            batch = stale[i:i + self.batch_size]
+            await self.archive.run(self.archive.write, [ticket_to_data(t) for t in batch])
+            """ Archived copies are durable, drop the hot ones """
+            for ticket_instance in batch:
+                if ticket_instance.is_open:
+                    """ Reopened while being archived """
+                    await self.archive.run(self.archive.drop, guild_id, ticket_instance.channel_id)
+                    continue
+                self.client.tickets.remove(guild_id, ticket_instance.channel_id)
+                self.client.dirty_tickets.discard(ticket_instance)
+                ticket_instance.dirty = False
+                await self.client.data_source.delete(source.DataTypes.ticket(guild_id, ticket_instance.channel_id))
+        if len(stale) > 0:
+            print(f"Archived {len(stale)} closed tickets of guild {guild_id}")
+        return len(stale)
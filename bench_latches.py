@@ -0,0 +1,69 @@
+import time
+import argparse
+from types import SimpleNamespace
+from typing import Any, Callable, List
+
+from setup import Context, InputLatches
+
+
+def setup_contexts(count: int) -> List[Context]:
+    """ Contexts of count setups, each in its own channel """
+    contexts = []
+    for i in range(count):
+        ctx = Context()
+        ctx.channel = SimpleNamespace(id=i)
+        ctx.user = SimpleNamespace(id=10 ** 6 + i)
+        ctx.data = {}
+        contexts.append(ctx)
+    return contexts
+
+
+def rate(func: Callable[[], Any], seconds: float) -> float:
+    """ Calls func for the given seconds, returns calls per second """
+    calls = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        func()
+        calls += 1
+    return calls / (time.perf_counter() - started)
+
+
+def main():
+    """ Messages per second the on_message latch lookup handles while many setups run """
+    parser = argparse.ArgumentParser(description="Benchmarks the setup input latch lookup")
+    parser.add_argument("--setups", type=int, default=10000, help="Concurrent setups")
+    parser.add_argument("--seconds", type=float, default=1.0, help="Duration of every measurement")
+    args = parser.parse_args()
+
+    contexts = setup_contexts(args.setups)
+    messages = {
+        "unrelated channel": SimpleNamespace(channel=SimpleNamespace(id=-1), author=SimpleNamespace(id=-1)),
+        "setup channel": SimpleNamespace(channel=contexts[-1].channel, author=contexts[-1].user)
+    }
+
+    """ Previous lookup, every message scanned the latches of all setups """
+    scanned = {ctx: None for ctx in contexts}
+    latches = InputLatches()
+    for ctx in contexts:
+        latches.add(ctx, None)
+
+    print(f"{args.setups} concurrent setups")
+    for name, message in messages.items():
+        def scan():
+            def input_latch_filter(ctx):
+                return ctx.channel.id == message.channel.id and ctx.user.id == message.author.id
+
+            input_latch_list = [latch_context for latch_context in scanned if input_latch_filter(latch_context)]
+            if len(input_latch_list) > 0:
+                return scanned[input_latch_list.pop()]
+
+        def lookup():
+            if latches.has_channel(message.channel.id):
+                return latches.get(message.channel.id, message.author.id)
+
+        print(f"Message in {name}: {rate(scan, args.seconds):,.0f} messages/s scanning, "
+              f"{rate(lookup, args.seconds):,.0f} messages/s with InputLatches")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import argparse
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+from table import TicketTable
+from ticket import Ticket, ticket_from_data
+
+
+class UnslottedTicket:
+    """ Ticket layout before __slots__, every instance has a __dict__ and a persistent dict """
+
+
+def ticket_records(count: int) -> List[Dict[str, Any]]:
+    return [{
+        "channel_id": 10 ** 17 + i,
+        "author_id": 10 ** 17 + i % 5000,
+        "category": "general",
+        "title": f"title {i}",
+        "description": f"description {i}",
+        "is_open": i % 3 != 0,
+        "persistent_data": {},
+        "created_at": 1.7e9 + i,
+        "updated_at": 1.7e9 + i
+    } for i in range(count)]
+
+
+def unslotted(ticket: Ticket) -> UnslottedTicket:
+    copy = UnslottedTicket()
+    for name in Ticket.__slots__:
+        setattr(copy, name, getattr(ticket, name))
+    copy.persistent = copy.persistent or {}
+    return copy
+
+
+def traced(build: Callable[[], Any]) -> int:
+    """ Bytes allocated by build and still held by its result """
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def report(name: str, size: int, count: int):
+    print(f"  {name}: {size / 2 ** 20:.1f} MiB ({size // count} B/ticket)")
+
+
+def main():
+    """
+    Memory held by loaded tickets, measured with tracemalloc. Titles and
+    descriptions come from the records and are shared, so they are not counted.
+    """
+    parser = argparse.ArgumentParser(description="Benchmarks the memory of loaded tickets")
+    parser.add_argument("--tickets", type=int, nargs="+", default=[100000, 1000000], help="Ticket counts")
+    args = parser.parse_args()
+
+    for count in args.tickets:
+        records = ticket_records(count)
+        print(f"{count} tickets")
+        tickets = [ticket_from_data(None, 1, record) for record in records]
+        report("without __slots__", traced(lambda: [unslotted(t) for t in tickets]), count)
+        del tickets
+        report("Ticket", traced(lambda: [ticket_from_data(None, 1, record) for record in records]), count)
+
+        def build_table():
+            table = TicketTable()
+            for record in records:
+                table.append_data(1, record)
+            return table
+
+        report("TicketTable", traced(build_table), count)
+
+
+if __name__ == "__main__":
+    main()
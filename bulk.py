@@ -0,0 +1,104 @@
+import time
+import asyncio
+import traceback
+from typing import Any, Awaitable, Callable, List, Optional
+
+from scheduler import Priority
+from ticket import Ticket
+
+
+class BulkProgress:
+    total: int
+    done: int
+    failed: int
+
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+
+    def __str__(self):
+        return f"{self.done + self.failed}/{self.total} processed, {self.failed} failed"
+
+
+async def run_batches(tickets: List[Ticket],
+                      func: Callable[[Ticket], Awaitable[Any]],
+                      batch_size: int = 5,
+                      on_progress: Optional[Callable[[BulkProgress], Awaitable[None]]] = None) -> BulkProgress:
+    """ Runs func for every ticket, batch_size at once, reporting progress after every batch """
+    progress = BulkProgress(len(tickets))
+    for i in range(0, len(tickets), batch_size):
+        results = await asyncio.gather(*[func(t) for t in tickets[i:i + batch_size]], return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                progress.failed += 1
+                traceback.print_exception(type(result), result, result.__traceback__)
+            else:
+                progress.done += 1
+        if on_progress is not None:
+            try:
+                await on_progress(progress)
+            except Exception:
+                """ Reporting must not stop the remaining batches """
+                traceback.print_exc()
+    return progress
+
+
+bulk_actions = {
+    "close": lambda client, t: t.change_open_state(open_state=False, priority=Priority.background),
+    "reopen": lambda client, t: t.change_open_state(open_state=True, priority=Priority.background),
+    "delete": lambda client, t: client.delete_ticket(t, priority=Priority.background)
+}
+
+
+class IdleTicketCloser:
+    """
+    Periodically closes open tickets of hydrated guilds that had no activity for
+    the guild's auto_close_hours. Stale tickets are read from the front of the
+    registry activity order, so a check only visits the tickets it closes. A
+    ticket that fails to close is touched, so it is retried after another
+    auto_close_hours instead of on every check. Guilds evicted by
+    idle_guild_ttl are not checked until they are hydrated again.
+    """
+    client: Any  # TicketBot
+    interval: float
+    batch_size: int
+    closed: int
+
+    def __init__(self, client, interval: float = 300, batch_size: int = 5):
+        self.client = client
+        self.interval = interval
+        self.batch_size = batch_size
+        self.closed = 0
+
+    async def loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            for guild_id in list(self.client.hydrated):
+                try:
+                    await self.close_idle(guild_id)
+                except Exception:
+                    print(f"Failed to auto-close idle tickets of guild {guild_id}:")
+                    traceback.print_exc()
+
+    async def close_idle(self, guild_id: int) -> Optional[BulkProgress]:
+        guild_settings = self.client.settings.get(guild_id)
+        if guild_settings is None or guild_settings.auto_close_hours <= 0:
+            return None
+        deadline = time.time() - guild_settings.auto_close_hours * 3600
+        stale = self.client.tickets.least_active(guild_id, before=deadline)
+        if len(stale) == 0:
+            return None
+        progress = await run_batches(stale, self.close_ticket, self.batch_size)
+        self.closed += progress.done
+        print(f"Auto-closed idle tickets of guild {guild_id}: {progress}")
+        return progress
+
+    async def close_ticket(self, ticket_instance: Ticket):
+        try:
+            await bulk_actions["close"](self.client, ticket_instance)
+        except Exception:
+            """ Move it out of the stale front of the activity order """
+            if ticket_instance.is_open:
+                ticket_instance.touch()
+            raise
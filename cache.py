@@ -1,13 +1,81 @@
-from typing import Dict
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
 
-from user import TicketUser
+from user import TicketUser, GuildRoles
+
+
+class LRUCache:
+    """ Bounded mapping, evicts the least recently used entry when full and entries older than ttl """
+    max_size: int
+    ttl: Optional[float]
+    entries: "OrderedDict[Hashable, Any]"
+    hits: int
+    misses: int
+    evictions: int
+
+    def __init__(self, max_size: int = 1000, ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.entries[key]
+            self.evictions += 1
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        self.entries[key] = (value, expires_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+    def __len__(self):
+        return len(self.entries)
 
 
 class GuildCache:
-    users: Dict[int, TicketUser] = {}
+    users: LRUCache
+    roles: Optional[GuildRoles]  # Loaded on first use
+
+    def __init__(self, max_users: int = 1000, user_ttl: Optional[float] = None):
+        self.users = LRUCache(max_size=max_users, ttl=user_ttl)
+        self.roles = None
 
     def save_user(self, user_id: int, user_inst: TicketUser):
-        self.users[user_id] = user_inst
+        self.users.put(user_id, user_inst)
 
     def get_user(self, user_id: int):
         return self.users.get(user_id)
+
+    def invalidate_user(self, user_id: int):
+        self.users.invalidate(user_id)
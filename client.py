@@ -1,22 +1,31 @@
-import json
 import random
+import time
+import asyncio
+import traceback
 from asyncio import Future
-from typing import Any, Dict, TYPE_CHECKING
+from typing import Any, Dict, List, Optional, Set, Tuple, TYPE_CHECKING
 
 import discord
-from discord import Guild, Embed, NotFound, SelectOption
-from discord.ui import View, Select
+from discord import Guild, Embed, NotFound
 
 import source
 import ticket
 from cache import GuildCache
-from errors import InvalidGuildStateError
-from event import EventEmitter, EventTypes
+from errors import InvalidGuildStateError, TicketLimitReachedError
+from resolver import Resolver
+from scheduler import RestScheduler, Priority
+from pool import ChannelPool
+from registry import TicketRegistry
+from bulk import IdleTicketCloser
+from transcript import TranscriptExporter
+from archive import Archiver, TicketArchive
+from entry import EntryMessageView, entry_message_embed, entry_message_hash
+from event import EventEmitter, EventTypes, OverflowPolicy
 from settings import GuildSettings, starter_settings
-from setup import input_latches, option_latches, ChannelSetup, Context, OptionsPart, InputPart
-from source import DataSource
+from setup import input_latches, option_latches, setups, ChannelSetup, Context, OptionsPart, InputPart
+from source import DataSource, AsyncDataSource
 from ticket import Ticket, Category, ticket_from_data, ticket_to_data
-from user import user, TicketUser
+from user import user, guild_roles, role_change_hooks, GuildRoles, TicketUser
 
 
 class TicketBot(discord.Client):
@@ -24,16 +33,121 @@ class TicketBot(discord.Client):
     events: EventEmitter = EventEmitter(super)
 
     if TYPE_CHECKING:
-        data_source: DataSource
-        tickets: Dict[int, Dict[int, Ticket]]
+        data_source: AsyncDataSource
+        tickets: TicketRegistry
+        dirty_tickets: Set[Ticket]
+        pending_tickets: Dict[Tuple[int, int], int]  # (Guild ID, user ID) -> tickets being created
         settings: Dict[int, GuildSettings]
         caches: Dict[int, GuildCache]
+        resolver: Resolver
+        rest: RestScheduler
+        channel_pool: ChannelPool
+        entry_view: EntryMessageView
+        idle_closer: IdleTicketCloser
+        transcripts: TranscriptExporter
+        archive: Optional[TicketArchive]
+        archiver: Optional[Archiver]
         commands: discord.app_commands.CommandTree
-
-    def __init__(self, *, intents: discord.Intents, data_source: DataSource, **options: Any):
+        # Hydration state, guild id -> last access (monotonic)
+        hydrated: Dict[int, float]
+        hydrating: Dict[int, asyncio.Task]
+        startup_time: float
+        first_guild_time: Optional[float]  # Startup until the first guild was reconciled
+        reconcile_time: float
+
+    def __init__(self, *,
+                 intents: discord.Intents,
+                 data_source: DataSource,
+                 flush_interval: float = 1.0,
+                 lazy_hydration: bool = False,
+                 idle_guild_ttl: float = None,
+                 user_cache_size: int = 1000,
+                 user_cache_ttl: float = None,
+                 event_workers: int = 0,
+                 event_queue_size: int = 1000,
+                 event_overflow: OverflowPolicy = OverflowPolicy.block,
+                 rest_concurrency: int = 8,
+                 rest_guild_concurrency: int = 2,
+                 auto_close_interval: float = 300,
+                 bulk_batch_size: int = 5,
+                 transcript_dir: str = "transcripts",
+                 transcript_concurrency: int = 2,
+                 transcript_on_close: bool = False,
+                 archive_after: float = None,
+                 archive_dir: str = "archive",
+                 bootstrap_concurrency: int = 16,
+                 **options: Any):
+        """
+        lazy_hydration: Load guild settings and tickets on first access instead of on ready
+        idle_guild_ttl: Seconds without access after which a lazily hydrated guild is unloaded from memory,
+            evicted guilds are not auto-closed until accessed again
+        user_cache_size: Max cached users per guild
+        user_cache_ttl: Seconds after which a cached user is loaded again
+        event_workers: Workers of the bounded event queue, 0 runs every emitted event in its own task
+        event_queue_size: Max queued events
+        event_overflow: What happens with events emitted to a full queue
+        rest_concurrency: Max ticket REST operations running at once
+        rest_guild_concurrency: Max ticket REST operations running at once in one guild
+        auto_close_interval: Seconds between checks for idle tickets to auto-close
+        bulk_batch_size: Tickets processed at once by bulk operations and auto-close
+        transcript_dir: Directory of exported ticket transcripts
+        transcript_concurrency: Max transcript exports running at once
+        transcript_on_close: Export the transcript of every closed ticket
+        archive_after: Seconds after which closed tickets move to the archive, None keeps them in memory
+        archive_dir: Directory of the closed tickets archive
+        bootstrap_concurrency: Max guilds loaded and reconciled at once on startup
+        """
         super().__init__(intents=intents, **options)
-        self.data_source = data_source
+        self.events.holder = self
+        self.resolver = Resolver(self)
+        self.rest = RestScheduler(concurrency=rest_concurrency, per_guild_concurrency=rest_guild_concurrency)
+        self.channel_pool = ChannelPool(self)
+        self.entry_view = EntryMessageView(self)
+        self.idle_closer = IdleTicketCloser(self, interval=auto_close_interval, batch_size=bulk_batch_size)
+        self.transcripts = TranscriptExporter(self, directory=transcript_dir, concurrency=transcript_concurrency)
+        self.transcript_on_close = transcript_on_close
+        self.archive = TicketArchive(archive_dir) if archive_after is not None else None
+        self.archiver = Archiver(self, self.archive, max_age=archive_after) if self.archive is not None else None
+        self.data_source = AsyncDataSource(data_source, flush_interval=flush_interval)
+        self.data_source.flush_hooks.append(self.save_tickets)
+        self.lazy_hydration = lazy_hydration
+        self.idle_guild_ttl = idle_guild_ttl
+        self.user_cache_size = user_cache_size
+        self.user_cache_ttl = user_cache_ttl
+        self.event_workers = event_workers
+        self.event_queue_size = event_queue_size
+        self.event_overflow = event_overflow
+        self.tickets = TicketRegistry()
+        self.dirty_tickets = set()
+        self.pending_tickets = {}
+        self.settings = {}
         self.caches = {}
+        self.hydrated = {}
+        self.hydrating = {}
+        self.legacy_tickets = {}
+        self.legacy_settings = {}
+        self.bootstrap_concurrency = bootstrap_concurrency
+        self.bootstrapped = False
+        self.startup_time = 0
+        self.first_guild_time = None
+        self.reconcile_time = 0
+        role_change_hooks.append(self.on_user_role_change)
+
+    async def setup_hook(self):
+        self.add_view(self.entry_view)
+        self.data_source.start()
+        self.rest.start()
+        if self.event_workers > 0:
+            self.events.start_queue(
+                workers=self.event_workers, max_size=self.event_queue_size, overflow=self.event_overflow)
+        self.legacy_tickets = await self.data_source.load(source.DataTypes.tickets) or {}
+        self.legacy_settings = await self.data_source.load(source.DataTypes.settings) or {}
+        if self.lazy_hydration and self.idle_guild_ttl is not None:
+            self.loop.create_task(self.evict_idle_guilds_loop())
+        self.loop.create_task(self.idle_closer.loop())
+        if self.archive is not None:
+            self.archive.open()
+            self.loop.create_task(self.archiver.loop())
 
     async def create_ticket(self, guild: Guild, user: discord.User, **kwargs) -> Future[Ticket]:
         """
@@ -51,45 +165,96 @@ class TicketBot(discord.Client):
         Raises
         InvalidGuildStateError
             if the guild is not prepared.
+        TicketLimitReachedError
+            if the user has the max open tickets of the guild.
         """
-        if not self.is_guild_prepared(guild):
+        if not await self.is_guild_prepared(guild):
             raise InvalidGuildStateError()
         guild_settings = self.settings.get(guild.id)
+        if not self.can_open_ticket(guild.id, user.id):
+            raise TicketLimitReachedError(guild_settings.max_open_tickets)
+        """ Hold a slot before the first await, so concurrent creations of the user see it """
+        self.reserve_ticket_slot(guild.id, user.id)
+        try:
+            return await self.make_ticket(guild, user, guild_settings, **kwargs)
+        finally:
+            self.release_ticket_slot(guild.id, user.id)
+
+    def reserve_ticket_slot(self, guild_id: int, user_id: int):
+        self.pending_tickets[(guild_id, user_id)] = self.pending_tickets.get((guild_id, user_id), 0) + 1
+
+    def release_ticket_slot(self, guild_id: int, user_id: int):
+        pending = self.pending_tickets[(guild_id, user_id)] - 1
+        if pending > 0:
+            self.pending_tickets[(guild_id, user_id)] = pending
+        else:
+            del self.pending_tickets[(guild_id, user_id)]
 
+    async def make_ticket(self, guild: Guild, user: discord.User, guild_settings: GuildSettings, **kwargs):
         setup_args = ["category", "title", "description"]
         if len([arg for arg in setup_args if kwargs.get(arg) is None]) > 0:
             """ Optional arguments are not fulfilled, starting setup """
-            await guild.fetch_channels()
-            prepare_category_channel = guild.get_channel(guild_settings.prepare_tickets_category)
-            ticket_channel = await prepare_category_channel.create_text_channel(
-                name=f"preparing-{user.name}-{random.randint(0, 999)}")
-            ticket_channel_overwrites = ticket_channel.overwrites_for(user)
-            await ticket_channel.set_permissions(guild.get_member(user.id), overwrite=ticket_channel_overwrites)
+            preparing_name = f"preparing-{user.name}-{random.randint(0, 999)}"
+            prepare_category_channel = await self.resolver.channel(guild_settings.prepare_tickets_category, guild)
+            ticket_channel = await self.channel_pool.claim(guild, guild_settings)
+            if ticket_channel is not None:
+                """ Pooled channels are hidden, give them the prepare category permissions and let the author in """
+                ticket_channel = await self.rest.submit(
+                    guild.id, ticket_channel.edit, priority=Priority.user, coalesce_key=("edit", ticket_channel.id),
+                    name=preparing_name, overwrites={
+                        **prepare_category_channel.overwrites,
+                        await self.resolver.member(guild, user.id):
+                            Ticket.open_overwrites(overwrites=discord.PermissionOverwrite())
+                    }
+                )
+            else:
+                ticket_channel = await self.rest.submit(
+                    guild.id, prepare_category_channel.create_text_channel, priority=Priority.user,
+                    name=preparing_name
+                )
+                ticket_channel_overwrites = ticket_channel.overwrites_for(user)
+                await self.rest.submit(
+                    guild.id, ticket_channel.set_permissions, priority=Priority.user,
+                    target=await self.resolver.member(guild, user.id), overwrite=ticket_channel_overwrites
+                )
             if kwargs.get("category") is not None:
-                category = list(filter(lambda c: c.lc_name == kwargs.get("category"), ticket.categories)).pop()
+                category = ticket.get_category(kwargs.get("category"))
                 await ticket_channel.send(embed=Embed(title=category.name, description=category.long_desc))
 
             setup_ticket_future: Future[Ticket] = Future()
 
             async def handle_setup_complete(status: int, ctx: Context):
+                self.release_ticket_slot(guild.id, user.id)
                 if status == 0:
                     """ Load setup results from context """
                     category_id = ctx.data["category"]
                     title = ctx.data["title"]
                     description = ctx.data["description"]
-                    category_instance: Category = [c for c in ticket.categories if c.lc_name == category_id].pop()
+                    category_instance: Category = ticket.get_category(category_id)
 
                     def when_complete(fut):
                         setup_ticket_future.set_result(fut.result())
 
-                    (await self.create_ticket(
-                        guild=guild, user=user,
-                        category=category_instance, title=title,
-                        description=description, channel_id=ticket_channel.id
-                    )).add_done_callback(when_complete)
+                    try:
+                        (await self.create_ticket(
+                            guild=guild, user=user,
+                            category=category_instance, title=title,
+                            description=description, channel_id=ticket_channel.id
+                        )).add_done_callback(when_complete)
+                        return
+                    except TicketLimitReachedError:
+                        """ Another ticket of the user was opened while this setup ran """
+                        reason = "Open tickets limit reached."
                 else:
-                    await ticket_channel.delete(reason="Ticket setup finished with non-zero value.")
-                    setup_ticket_future.cancel()
+                    reason = "Ticket setup finished with non-zero value."
+                try:
+                    await self.rest.submit(
+                        guild.id, ticket_channel.delete, priority=Priority.background, reason=reason
+                    )
+                except NotFound:
+                    """ Deleted by hand """
+                    pass
+                setup_ticket_future.cancel()
 
             setup = ChannelSetup(channel=ticket_channel, user=user, on_done=handle_setup_complete)
             """ Load setup parts and ids in context """
@@ -116,39 +281,67 @@ class TicketBot(discord.Client):
                     setup.add_part(ticket_setup_parts.get(arg))
                 else:
                     setup.context.data[arg] = kwargs.get(arg)
-            await setup.run()
+            """ The running setup holds a slot, released by handle_setup_complete only """
+            self.reserve_ticket_slot(guild.id, user.id)
+            try:
+                await setup.run()
+            except Exception:
+                """ Unregisters the setup, releases its slot and deletes the channel unless it already completed """
+                try:
+                    await setup.cancel()
+                except Exception:
+                    traceback.print_exc()
+                raise
             return setup_ticket_future
 
         category: Category = kwargs["category"]
         channel_name = f"{category.lc_name}-{user.name}-{random.randint(0, 999)}"
         channel_id = kwargs.get("channel_id") or -1
         channel: discord.TextChannel
-        category_channel = await guild.fetch_channel(guild_settings.tickets_category)
+        category_channel = await self.resolver.channel(guild_settings.tickets_category, guild)
 
         if channel_id == -1:
-            channel = await category_channel.create_text_channel(name=channel_name)
+            """ Setup skipped, create or claim the channel with its final name and permissions at once """
+            overwrites = {
+                **category_channel.overwrites,
+                await self.resolver.member(guild, user.id): Ticket.open_overwrites(
+                    overwrites=discord.PermissionOverwrite())
+            }
+            channel = await self.channel_pool.claim(guild, guild_settings)
+            if channel is not None:
+                channel = await self.rest.submit(
+                    guild.id, channel.edit, priority=Priority.user, coalesce_key=("edit", channel.id),
+                    name=channel_name, category=category_channel, overwrites=overwrites
+                )
+            else:
+                channel = await self.rest.submit(
+                    guild.id, category_channel.create_text_channel, priority=Priority.user,
+                    name=channel_name, overwrites=overwrites
+                )
         else:
-            channel = await guild.fetch_channel(channel_id)
-            channel = await channel.edit(name=channel_name, category=category_channel)
+            channel = await self.resolver.channel(channel_id, guild)
+            channel = await self.rest.submit(
+                guild.id, channel.edit, priority=Priority.user, coalesce_key=("edit", channel.id),
+                name=channel_name, category=category_channel
+            )
+            overwrites = Ticket.open_overwrites(overwrites=channel.overwrites_for(user))
+            await self.rest.submit(
+                guild.id, channel.set_permissions, priority=Priority.user,
+                target=await self.resolver.member(guild, user.id), overwrite=overwrites
+            )
 
         channel_id = channel.id
         ticket_instance = Ticket(
-            client=self, channel_id=channel_id,
+            client=self, guild_id=guild.id, channel_id=channel_id,
             author_id=user.id, category=category,
             title=kwargs.get("title"), description=kwargs.get("description")
         )
 
-        overwrites = ticket_instance.open_overwrites(overwrites=channel.overwrites_for(user))
-        await channel.set_permissions(target=guild.get_member(user.id), overwrite=overwrites)
-
-        if self.tickets.get(guild.id) is None:
-            self.tickets[guild.id] = {}
-
-        self.tickets[guild.id][channel_id] = ticket_instance
-        self.save_tickets()
+        self.tickets.add(ticket_instance)
+        ticket_instance.mark_dirty()
 
         await ticket_instance.send_welcome_message()
-        await self.events.call(EventTypes.ticket_create, {
+        await self.events.emit(EventTypes.ticket_create, {
             "ticket": ticket_instance,
             "channel": channel
         })
@@ -157,131 +350,320 @@ class TicketBot(discord.Client):
         future.set_result(ticket_instance)
         return future
 
-    def get_ticket(self, channel: discord.TextChannel):
-        guild_tickets = self.tickets.get(channel.guild.id) or {}
-        return guild_tickets.get(channel.id)
-
-    def get_user(self, member: discord.Member) -> TicketUser:
-        cache = self.get_guild_caches(member.guild)
+    async def get_ticket(self, channel: discord.TextChannel):
+        await self.hydrate_guild(channel.guild.id)
+        ticket_instance = self.tickets.get(channel.guild.id, channel.id)
+        if ticket_instance is None and self.archive is not None:
+            ticket_instance = await self.restore_ticket(channel.guild.id, channel.id)
+        return ticket_instance
+
+    async def restore_ticket(self, guild_id: int, channel_id: int) -> Optional[Ticket]:
+        """ Moves an archived ticket back to memory and the data source """
+        data = await self.archive.run(self.archive.read, guild_id, channel_id)
+        if data is None or self.tickets.get(guild_id, channel_id) is not None:
+            return self.tickets.get(guild_id, channel_id)
+        ticket_instance = ticket_from_data(self, guild_id, data)
+        self.tickets.add(ticket_instance)
+        ticket_instance.touch()
+        await self.archive.run(self.archive.drop, guild_id, channel_id)
+        return ticket_instance
+
+    async def delete_ticket(self, ticket_instance: Ticket, priority: Priority = Priority.background):
+        """ Deletes the ticket channel and record """
+        try:
+            channel = await ticket_instance.fetch_channel()
+            await self.rest.submit(ticket_instance.guild_id, channel.delete, priority=priority, reason="Ticket deleted")
+        except NotFound:
+            pass
+        self.tickets.remove(ticket_instance.guild_id, ticket_instance.channel_id)
+        self.dirty_tickets.discard(ticket_instance)
+        await self.data_source.delete(source.DataTypes.ticket(ticket_instance.guild_id, ticket_instance.channel_id))
+
+    def can_open_ticket(self, guild_id: int, user_id: int) -> bool:
+        guild_settings = self.settings.get(guild_id)
+        if guild_settings is None or guild_settings.max_open_tickets <= 0:
+            return True
+        open_count = self.tickets.count_open(guild_id, user_id) + self.pending_tickets.get((guild_id, user_id), 0)
+        return open_count < guild_settings.max_open_tickets
+
+    async def query_tickets(self, guild: Guild, **filters) -> List[Ticket]:
+        """ Tickets of the guild matching the filters, see TicketRegistry.query """
+        await self.hydrate_guild(guild.id)
+        return self.tickets.query(guild.id, **filters)
+
+    async def get_user(self, member: discord.Member) -> TicketUser:
+        cache = await self.get_guild_caches(member.guild)
         user_id = member.id
         user_inst = cache.get_user(user_id)
         if user_inst is None:
-            user_inst = user(self.data_source, member.guild.id, user_id)
+            roles_inst = await self.get_guild_roles(member.guild)
+            user_inst = await user(self.data_source, member.guild.id, user_id, roles_inst)
             cache.save_user(user_id, user_inst)
         return user_inst
 
-    def get_guild_settings(self, guild: Guild):
+    async def get_guild_roles(self, guild: Guild) -> GuildRoles:
+        cache = await self.get_guild_caches(guild)
+        if cache.roles is None:
+            cache.roles = await guild_roles(self.data_source, guild.id)
+        return cache.roles
+
+    def on_user_role_change(self, user_inst: TicketUser):
+        cache = self.caches.get(user_inst.guild_id)
+        if cache is not None:
+            cache.invalidate_user(user_inst.id)
+
+    def user_cache_stats(self) -> Dict[str, int]:
+        stats = {"size": 0, "hits": 0, "misses": 0, "evictions": 0}
+        for cache in self.caches.values():
+            for k, v in cache.users.stats().items():
+                stats[k] += v
+        return stats
+
+    async def get_guild_settings(self, guild: Guild):
+        await self.hydrate_guild(guild.id)
         return self.settings.get(guild.id)
 
-    def get_guild_caches(self, guild: Guild):
+    async def get_guild_caches(self, guild: Guild):
+        await self.hydrate_guild(guild.id)
         return self.caches.get(guild.id)
 
-    def is_guild_prepared(self, guild: Guild) -> bool:
+    async def is_guild_prepared(self, guild: Guild) -> bool:
+        await self.hydrate_guild(guild.id)
         guild_settings = self.settings.get(guild.id)
         guild_caches = self.caches.get(guild.id)
         return guild_caches is not None and guild_settings is not None and guild_settings.is_prepared()
 
-    def init_guild(self, guild: discord.Guild):
-        if guild.id not in self.settings.keys():
-            self.settings[guild.id] = starter_settings()
-        if guild.id not in self.tickets.keys():
-            self.tickets[guild.id] = {}
-        self.caches[guild.id] = GuildCache()
-
-    async def reload_guild(self, guild: discord.Guild):
-        self.init_guild(guild)
-
-        await self.unload_guild(guild)
+    def init_guild(self, guild_id: int):
+        if guild_id not in self.settings.keys():
+            self.settings[guild_id] = starter_settings()
+        if guild_id not in self.caches.keys():
+            self.caches[guild_id] = GuildCache(max_users=self.user_cache_size, user_ttl=self.user_cache_ttl)
+
+    async def hydrate_guild(self, guild_id: int):
+        """ Makes sure settings and tickets of the guild are in memory """
+        if guild_id in self.hydrated:
+            self.hydrated[guild_id] = time.monotonic()
+            return
+        task = self.hydrating.get(guild_id)
+        if task is None:
+            task = asyncio.ensure_future(self.load_guild(guild_id))
+            self.hydrating[guild_id] = task
+            task.add_done_callback(lambda _: self.hydrating.pop(guild_id, None))
+        await asyncio.shield(task)
+
+    async def load_guild(self, guild_id: int):
+        await self.load_settings(guild_id)
+        await self.load_tickets(guild_id)
+        self.init_guild(guild_id)
+        self.hydrated[guild_id] = time.monotonic()
+
+    def evict_guild(self, guild_id: int) -> bool:
+        """
+        Drops the guild state from memory, it is hydrated again on next access.
+        Chat activity not saved yet is queued first, the guild is evicted once it
+        was flushed.
+        """
+        for ticket_instance in self.tickets.guild(guild_id).values():
+            if ticket_instance.updated_at != ticket_instance.saved_at:
+                ticket_instance.mark_dirty()
+        if any(t.guild_id == guild_id for t in self.dirty_tickets):
+            return False
+        if any(s.context.channel.guild.id == guild_id for s in setups):
+            return False
+        self.hydrated.pop(guild_id, None)
+        self.settings.pop(guild_id, None)
+        self.tickets.unload_guild(guild_id)
+        self.caches.pop(guild_id, None)
+        self.channel_pool.unload(guild_id)
+        return True
+
+    async def evict_idle_guilds_loop(self):
+        while True:
+            await asyncio.sleep(min(self.idle_guild_ttl, 60))
+            deadline = time.monotonic() - self.idle_guild_ttl
+            evicted = [gid for gid, last in list(self.hydrated.items()) if last < deadline and self.evict_guild(gid)]
+            if len(evicted) > 0:
+                print(f"Evicted {len(evicted)} idle guilds, {self.resident_guilds} resident")
+
+    @property
+    def resident_guilds(self) -> int:
+        return len(self.hydrated)
+
+    async def reload_guild(self, guild: discord.Guild, force: bool = False):
+        """
+        Makes sure the entry message shows the current content. It is sent when
+        missing and edited in place when its content hash changed, otherwise
+        nothing is sent. force always edits it, which re-sends a message deleted
+        while the bot was offline.
+        """
+        await self.hydrate_guild(guild.id)
 
         guild_settings = self.settings[guild.id]
-        if guild_settings.entry_channel is not None:
-            entry_channel = await guild.fetch_channel(guild_settings.entry_channel)
-            entry_message_embed = Embed(
-                title="Create Ticket",
-                description="Click on button below to create new ticket channel!"
-            )
-            bot_self = self
-            entry_message: discord.Message
-
-            class EntryMessageView(View):
-                def __init__(self):
-                    super().__init__()
-
-                @discord.ui.select(cls=Select, placeholder="Select Category", options=list(map(
-                    lambda category: SelectOption(
-                        label=category.name, value=category.lc_name, description=category.description
-                    ),
-                    ticket.categories
-                )))
-                async def handle_select_category(self, interaction: discord.Interaction, select: Select):
-                    await entry_message.edit()
-                    if bot_self.is_guild_prepared(interaction.guild):
-                        create_ticket_future = bot_self.create_ticket(
-                            guild=guild, user=interaction.user, category=select.values[0])
-                        await interaction.response.send_message(
-                            content="Ticket created, check tickets category!",
-                            ephemeral=True
-                        )
-                        await create_ticket_future
-                    else:
-                        await interaction.response.send_message(content="This guild is not set up!", ephemeral=True)
-
-            entry_message = await entry_channel.send(
-                embed=entry_message_embed,
-                view=EntryMessageView()
-            )
+        content_hash = entry_message_hash()
+        priority = Priority.user if force else Priority.background
+        changed = False
+        if guild_settings.entry_channel is not None and (force or guild_settings.entry_message is None
+                                                         or guild_settings.entry_message_hash != content_hash):
+            entry_channel = await self.resolver.channel(guild_settings.entry_channel, guild)
+            entry_message = None
+            if guild_settings.entry_message is not None:
+                try:
+                    entry_message = await self.rest.submit(
+                        guild.id, Resolver.message(entry_channel, guild_settings.entry_message).edit,
+                        priority=priority, embed=entry_message_embed(), view=self.entry_view
+                    )
+                except NotFound:
+                    pass
+            if entry_message is None:
+                entry_message = await self.rest.submit(
+                    guild.id, entry_channel.send, priority=priority,
+                    embed=entry_message_embed(), view=self.entry_view
+                )
+            """ A forced edit of an unchanged message needs no save """
+            changed = (entry_message.id != guild_settings.entry_message
+                       or guild_settings.entry_message_hash != content_hash)
             guild_settings.entry_message = entry_message.id
+            guild_settings.entry_message_hash = content_hash
 
-        self.save_settings()
+        if changed:
+            await self.save_settings(guild)
+        await self.channel_pool.reconcile(guild, guild_settings)
 
     async def unload_guild(self, guild: discord.Guild):
-        settings = self.settings[guild.id]
+        """ Deletes the entry message """
+        settings = await self.get_guild_settings(guild)
         if settings.entry_channel and settings.entry_message is not None:
             try:
-                entry_channel = await guild.fetch_channel(settings.entry_channel)
-                entry_message = await entry_channel.fetch_message(settings.entry_message)
-                await entry_message.delete()
+                entry_channel = await self.resolver.channel(settings.entry_channel, guild)
+                await self.rest.submit(
+                    guild.id, Resolver.message(entry_channel, settings.entry_message).delete,
+                    priority=Priority.background
+                )
             except NotFound:
-                return
+                pass
+        settings.entry_message = None
+        settings.entry_message_hash = None
 
     async def modify_settings(self, guild: Guild, modify_func):
-        await self.unload_guild(guild)
-        await modify_func(self.settings.get(guild.id))
-        self.save_settings()
+        settings = await self.get_guild_settings(guild)
+        entry_channel = settings.entry_channel
+        entry_message = settings.entry_message
+        await modify_func(settings)
+        if entry_message is not None and (
+                settings.entry_channel != entry_channel or settings.entry_message != entry_message):
+            """ Entry channel moved or message replaced, remove the old message """
+            moved_to, replaced_by = settings.entry_channel, settings.entry_message
+            settings.entry_channel, settings.entry_message = entry_channel, entry_message
+            await self.unload_guild(guild)
+            settings.entry_channel = moved_to
+            if replaced_by != entry_message:
+                settings.entry_message = replaced_by
+        await self.save_settings(guild)
         await self.reload_guild(guild)
 
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        """ Entry message deleted by hand, the next reload sends a new one """
+        settings = self.settings.get(payload.guild_id)
+        if settings is not None and settings.entry_message == payload.message_id:
+            settings.entry_message = None
+            settings.entry_message_hash = None
+            await self.data_source.save(source.DataTypes.guild_settings(payload.guild_id), settings.to_data())
+
     async def sync_commands(self, guild):
         self.commands.copy_global_to(guild=guild)
         await self.commands.sync(guild=guild)
 
-    def save_settings(self):
-        data: Dict[int, Any] = {}
-        for k in self.settings:
-            data[k] = self.settings[k].to_data()
-
-        self.data_source.save(source.DataTypes.settings, data)
+    async def save_settings(self, guild: Guild):
+        await self.data_source.save(source.DataTypes.guild_settings(guild.id), self.settings[guild.id].to_data())
+
+    async def load_settings(self, guild_id: int):
+        data = await self.data_source.load(source.DataTypes.guild_settings(guild_id))
+        if data is None:
+            """ Fall back to the old all-guilds record, JSON keys are strings once reloaded """
+            data = self.legacy_settings.get(str(guild_id)) or self.legacy_settings.get(guild_id)
+        if data is not None:
+            self.settings[guild_id] = GuildSettings(data)
+
+    async def load_tickets(self, guild_id: int):
+        tickets_data = await self.data_source.load_prefix(source.DataTypes.guild_tickets(guild_id))
+        for ticket_data in sorted(tickets_data.values(), key=lambda data: data.get("updated_at") or 0):
+            self.tickets.add(ticket_from_data(self, guild_id, ticket_data))
+        legacy_guild_tickets = self.legacy_tickets.get(str(guild_id)) or self.legacy_tickets.get(guild_id) or {}
+        for ticket_data in legacy_guild_tickets.values():
+            channel_id = int(ticket_data["channel_id"])
+            if self.tickets.get(guild_id, channel_id) is None and not await self.is_archived(guild_id, channel_id):
+                """ Move the ticket over to its own record """
+                ticket_instance = ticket_from_data(self, guild_id, ticket_data)
+                self.tickets.add(ticket_instance)
+                ticket_instance.mark_dirty()
+
+    async def is_archived(self, guild_id: int, channel_id: int) -> bool:
+        if self.archive is None:
+            return False
+        return await self.archive.run(self.archive.contains, guild_id, channel_id)
 
     def save_tickets(self):
-        data = {}
-        for guild_id in self.tickets:
-            data[guild_id] = {}
-            for ticket_channel_id in self.tickets[guild_id]:
-                data[guild_id][ticket_channel_id] = ticket_to_data(self.tickets[guild_id][ticket_channel_id])
+        """ Queues tickets changed since the last flush, runs before every data source flush """
+        dirty_tickets, self.dirty_tickets = self.dirty_tickets, set()
+        for ticket_instance in dirty_tickets:
+            ticket_instance.dirty = False
+            ticket_instance.saved_at = ticket_instance.updated_at
+            self.data_source.save_nowait(
+                source.DataTypes.ticket(ticket_instance.guild_id, ticket_instance.channel_id),
+                ticket_to_data(ticket_instance)
+            )
 
     async def on_ready(self):
-        self.tickets = {}
-        self.settings = {}
-        tickets_data = self.data_source.load(source.DataTypes.tickets) or {}
-        settings_data = self.data_source.load(source.DataTypes.settings) or {}
-        for guild_id in settings_data:
-            self.settings[int(guild_id)] = GuildSettings(settings_data[guild_id])
-        for guild_id in tickets_data:
-            self.tickets[int(guild_id)] = {}
-            for ticket_channel_id in tickets_data[guild_id]:
-                ticket_instance = ticket_from_data(self, tickets_data[guild_id][ticket_channel_id])
-                self.tickets[guild_id][int(ticket_channel_id)] = ticket_instance
-        [self.init_guild(guild) for guild in self.guilds]
-        print(f"Loaded {len(self.tickets)} guilds!")
+        if self.bootstrapped:
+            """ Reconnected, state is still in memory """
+            return
+        self.bootstrapped = True
+        started = time.perf_counter()
+        if not self.lazy_hydration:
+            await self.bootstrap_guilds(started)
+        self.startup_time = time.perf_counter() - started
+        print(f"Ready in {self.startup_time:.2f}s, {self.resident_guilds}/{len(self.guilds)} guilds loaded!")
+        await self.transcripts.resume_pending()
+
+    async def bootstrap_guilds(self, started: float):
+        """
+        Loads all guilds, then reconciles their entry messages and channel pools,
+        bootstrap_concurrency guilds at once. Guilds with open tickets and an entry
+        message are reconciled first.
+        """
+        semaphore = asyncio.Semaphore(self.bootstrap_concurrency)
+        failed = []
+
+        async def run(guild: discord.Guild, func):
+            async with semaphore:
+                try:
+                    await func(guild)
+                    return True
+                except Exception:
+                    print(f"Failed to bootstrap {guild.name}:")
+                    traceback.print_exc()
+                    failed.append(guild.id)
+                    return False
+
+        await asyncio.gather(*[run(guild, lambda g: self.hydrate_guild(g.id)) for guild in self.guilds])
+        loaded = [guild for guild in self.guilds if guild.id in self.hydrated]
+
+        async def reconcile(guild: discord.Guild):
+            if await run(guild, self.reload_guild) and self.first_guild_time is None:
+                self.first_guild_time = time.perf_counter() - started
+
+        reconcile_started = time.perf_counter()
+        await asyncio.gather(*[reconcile(guild) for guild in sorted(loaded, key=self.bootstrap_priority)])
+        self.reconcile_time = time.perf_counter() - reconcile_started
+        first_guild_time = f"{self.first_guild_time:.2f}s" if self.first_guild_time is not None else "never"
+        print(f"Reconciled {len(loaded)} guilds in {self.reconcile_time:.2f}s, first served after {first_guild_time}, "
+              f"{len(failed)} failed")
+
+    def bootstrap_priority(self, guild: discord.Guild):
+        """ Sort key, busy guilds first """
+        guild_settings = self.settings.get(guild.id)
+        has_entry_message = guild_settings is not None and guild_settings.entry_message is not None
+        return self.tickets.count(guild.id, is_open=True) == 0, not has_entry_message
 
     async def on_guild_join(self, guild: discord.Guild):
         await self.sync_commands(guild)
@@ -289,22 +671,22 @@ class TicketBot(discord.Client):
         print(f"Joined {guild.name}")
 
     async def on_message(self, message: discord.Message):
+        if message.guild is not None:
+            """ Messages in open tickets count as activity for auto-close """
+            ticket_instance = self.tickets.get(message.guild.id, message.channel.id)
+            if ticket_instance is not None and ticket_instance.is_open:
+                ticket_instance.record_activity()
         """ Search for active setup input latches for messages """
-
-        def input_latch_filter(ctx):
-            return ctx.channel.id == message.channel.id and ctx.user.id == message.author.id
-
-        input_latch_list = [latch_context for latch_context in input_latches if input_latch_filter(latch_context)]
-        if len(input_latch_list) > 0:
-            await input_latches[input_latch_list.pop()](message)
+        if not input_latches.has_channel(message.channel.id):
+            return
+        input_latch = input_latches.get(message.channel.id, message.author.id)
+        if input_latch is not None:
+            await input_latch(message)
 
     async def on_interaction(self, interaction: discord.Interaction):
         if interaction.type == discord.InteractionType.component:
-            """ Search for button selection latches in setups """
-            custom_id = interaction.data["custom_id"]
-            option_latch_keys = [key for key in option_latches if custom_id in json.loads(key)]
-            if len(option_latch_keys) > 0:
-                await option_latches[option_latch_keys.pop()](custom_id)
+            """ Route button selection latches in setups """
+            await option_latches.route(interaction.data["custom_id"])
 
     @events.handler(event_name=EventTypes.setup_entry_channel_set)
     async def on_entry_channel_set(self, event):
@@ -318,3 +700,6 @@ class TicketBot(discord.Client):
             title="Ticket Closed",
             description="Ticket state has been changed to closed!"
         ))
+        if self.transcript_on_close:
+            ticket_instance: Ticket = event["ticket"]
+            self.transcripts.start(ticket_instance.guild_id, ticket_instance.channel_id)
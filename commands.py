@@ -1,9 +1,12 @@
+import time
+
 import discord
 from discord import Embed, Interaction
 from discord.ui import View
 
+from bulk import BulkProgress, bulk_actions, run_batches
 from event import EventTypes
-from settings import GuildSettings
+from settings import GuildSettings, setup_modes
 from setup import ChannelSetup, InputPart, Context
 
 
@@ -31,13 +34,22 @@ def init_commands(bot):
 
                     async def modify_settings_func(settings: GuildSettings):
                         settings.entry_channel = entry_channel.id
-                        settings.entry_message = None  # Entry message will be created on reload
 
                     await bot_self.modify_settings(interaction.guild, modify_settings_func)
                     await bot_self.events.call(EventTypes.setup_entry_channel_set, {
                         "interaction": interaction
                     })
 
+                @discord.ui.button(label="Toggle Setup Mode", style=discord.ButtonStyle.gray)
+                async def toggle_setup_mode_button(self, interaction: discord.Interaction, item):
+                    async def modify_settings_func(settings: GuildSettings):
+                        next_mode = (setup_modes.index(settings.setup_mode) + 1) % len(setup_modes)
+                        settings.setup_mode = setup_modes[next_mode]
+
+                    await bot_self.modify_settings(interaction.guild, modify_settings_func)
+                    setup_mode = (await bot_self.get_guild_settings(interaction.guild)).setup_mode
+                    await interaction.response.send_message(content=f"Setup mode set to {setup_mode}!", ephemeral=True)
+
                 @discord.ui.button(label="Set Ticket Categories", style=discord.ButtonStyle.gray)
                 async def set_ticket_categories_button(self, interaction: discord.Interaction, item):
 
@@ -80,14 +92,14 @@ def init_commands(bot):
 
             await response.send_message(embed=embed, ephemeral=True, view=CommandSetupView())
 
-        await bot.get_user(interaction.user).handle_restricted_interaction(
+        await (await bot.get_user(interaction.user)).handle_restricted_interaction(
             interaction, ["admin_setup"], handle_restricted
         )
 
     @command_group.command(name="panel", description="Ticket bot (ticket) admin command")
     async def ticket_panel_command(interaction: Interaction):
         async def handle_restricted():
-            ticket_instance = bot.get_ticket(interaction.channel)
+            ticket_instance = await bot.get_ticket(interaction.channel)
             if ticket_instance is None:
                 await interaction.response.send_message(content="You are not in a ticket!", ephemeral=True)
                 return
@@ -101,18 +113,28 @@ def init_commands(bot):
                     await ticket_instance.close()
                     await interaction.response.send_message(content="Ticket has been closed!", ephemeral=True)
 
+                @discord.ui.button(label="Export Transcript", style=discord.ButtonStyle.gray)
+                async def export_transcript_button(self, interaction: discord.Interaction, item):
+                    await interaction.response.defer(ephemeral=True, thinking=True)
+                    state = await bot.transcripts.start(ticket_instance.guild_id, ticket_instance.channel_id)
+                    if state is None:
+                        await interaction.followup.send(content="Transcript export failed!", ephemeral=True)
+                        return
+                    await interaction.followup.send(
+                        content=f"Transcript exported, {state['messages']} messages!", ephemeral=True)
+
             await interaction.response.send_message(embed=Embed(
                 title="Ticket Admin",
                 description="Choose what to do with this ticket!"
             ), view=TicketAdminView(), ephemeral=True)
 
-        await bot.get_user(interaction.user).handle_restricted_interaction(
+        await (await bot.get_user(interaction.user)).handle_restricted_interaction(
             interaction, ["ticket_panel"], handle_restricted
         )
 
     @command_group.command(name="admin", description="Ticket bot admin command")
     async def admin_command(interaction: Interaction):
-        ticket_user = bot.get_user(interaction.user)
+        ticket_user = await bot.get_user(interaction.user)
 
         async def handle_admin_panel():
             embed = discord.Embed(
@@ -126,7 +148,7 @@ def init_commands(bot):
 
     @command_group.command(name="synccommands", description="Synchronizes all tickets commands in this guild")
     async def sync_commands_command(interaction: Interaction):
-        user = bot.get_user(interaction.user)
+        user = await bot.get_user(interaction.user)
 
         async def handle_sync_commands():
             await bot.sync_commands(interaction.guild)
@@ -134,12 +156,142 @@ def init_commands(bot):
 
         await user.handle_restricted_interaction(interaction, ["sync_commands"], handle_sync_commands)
 
+    @command_group.command(name="poolsize", description="Set count of pre-created ticket channels, 0 disables")
+    async def pool_size_command(interaction: Interaction, size: discord.app_commands.Range[int, 0, 50]):
+        user = await bot.get_user(interaction.user)
+
+        async def handle_pool_size():
+            async def modify_settings_func(settings: GuildSettings):
+                settings.channel_pool_size = size
+
+            await bot.modify_settings(interaction.guild, modify_settings_func)
+            await interaction.response.send_message(f"Channel pool size set to {size}!", ephemeral=True)
+
+        await user.handle_restricted_interaction(interaction, ["admin_setup"], handle_pool_size)
+
+    @command_group.command(name="maxopen", description="Set max open tickets per user, 0 is unlimited")
+    async def max_open_command(interaction: Interaction, limit: discord.app_commands.Range[int, 0, 100]):
+        user = await bot.get_user(interaction.user)
+
+        async def handle_max_open():
+            async def modify_settings_func(settings: GuildSettings):
+                settings.max_open_tickets = limit
+
+            await bot.modify_settings(interaction.guild, modify_settings_func)
+            await interaction.response.send_message(f"Max open tickets per user set to {limit}!", ephemeral=True)
+
+        await user.handle_restricted_interaction(interaction, ["admin_setup"], handle_max_open)
+
+    @command_group.command(name="list", description="List tickets of this guild")
+    @discord.app_commands.choices(state=[
+        discord.app_commands.Choice(name="Open", value="open"),
+        discord.app_commands.Choice(name="Closed", value="closed")
+    ])
+    async def list_command(interaction: Interaction,
+                           author: discord.User = None,
+                           state: discord.app_commands.Choice[str] = None,
+                           category: str = None):
+        user = await bot.get_user(interaction.user)
+
+        async def handle_list():
+            tickets = await bot.query_tickets(
+                interaction.guild,
+                author_id=author.id if author is not None else None,
+                is_open=state.value == "open" if state is not None else None,
+                category=category,
+                limit=25
+            )
+            embed = Embed(title="Tickets", description=f"Showing {len(tickets)} matching tickets")
+            if bot.archive is not None and (state is None or state.value == "closed"):
+                archived = await bot.archive.run(
+                    bot.archive.count, interaction.guild.id, author.id if author is not None else None, category)
+                embed.set_footer(text=f"{archived} more closed tickets archived")
+            for ticket_instance in tickets:
+                status = "Open" if ticket_instance.is_open else "Closed"
+                embed.add_field(
+                    name=ticket_instance.title or "Untitled",
+                    value=f"<#{ticket_instance.channel_id}> by <@{ticket_instance.author_id}>, {status}",
+                    inline=False
+                )
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+
+        await user.handle_restricted_interaction(interaction, ["ticket_panel"], handle_list)
+
+    @command_group.command(name="autoclose", description="Close tickets idle for this many hours, 0 disables")
+    async def auto_close_command(interaction: Interaction, hours: discord.app_commands.Range[float, 0, 8760]):
+        user = await bot.get_user(interaction.user)
+
+        async def handle_auto_close():
+            async def modify_settings_func(settings: GuildSettings):
+                settings.auto_close_hours = hours
+
+            await bot.modify_settings(interaction.guild, modify_settings_func)
+            await interaction.response.send_message(f"Idle tickets auto-close set to {hours}h!", ephemeral=True)
+
+        await user.handle_restricted_interaction(interaction, ["admin_setup"], handle_auto_close)
+
+    @command_group.command(name="bulk", description="Close, reopen or delete many tickets at once")
+    @discord.app_commands.choices(action=[
+        discord.app_commands.Choice(name=action.capitalize(), value=action) for action in bulk_actions
+    ])
+    async def bulk_command(interaction: Interaction,
+                           action: discord.app_commands.Choice[str],
+                           category: str = None,
+                           older_than_hours: discord.app_commands.Range[float, 0] = None,
+                           confirm: bool = False):
+        user = await bot.get_user(interaction.user)
+
+        async def handle_bulk():
+            if action.value == "delete" and category is None and older_than_hours is None and not confirm:
+                await interaction.response.send_message(
+                    "This deletes every ticket of the guild, filter by category or age or set confirm!",
+                    ephemeral=True
+                )
+                return
+            """ Close only touches open tickets, reopen only closed ones """
+            is_open = {"close": True, "reopen": False}.get(action.value)
+            tickets = await bot.query_tickets(
+                interaction.guild, is_open=is_open, category=category,
+                updated_before=time.time() - older_than_hours * 3600 if older_than_hours is not None else None
+            )
+            if len(tickets) == 0:
+                await interaction.response.send_message("No matching tickets!", ephemeral=True)
+                return
+            await interaction.response.send_message(f"{action.name}: 0/{len(tickets)} processed", ephemeral=True)
+
+            progress_message = None
+
+            async def on_progress(progress: BulkProgress):
+                """ Falls back to a channel message once the interaction token expired """
+                nonlocal progress_message
+                content = f"{action.name}: {progress}"
+                try:
+                    if progress_message is None:
+                        await interaction.edit_original_response(content=content)
+                    else:
+                        await progress_message.edit(content=content)
+                    return
+                except discord.HTTPException:
+                    pass
+                if progress_message is None:
+                    try:
+                        progress_message = await interaction.channel.send(content=content)
+                    except discord.HTTPException:
+                        pass
+
+            await run_batches(
+                tickets, lambda t: bulk_actions[action.value](bot, t),
+                batch_size=bot.idle_closer.batch_size, on_progress=on_progress
+            )
+
+        await user.handle_restricted_interaction(interaction, ["bulk_manage"], handle_bulk)
+
     @command_group.command(name="reload", description="Reload ticket bot in this guild")
     async def reload_command(interaction: Interaction):
-        user = bot.get_user(interaction.user)
+        user = await bot.get_user(interaction.user)
 
         async def handle_reload():
-            await bot.reload_guild(interaction.guild)
+            await bot.reload_guild(interaction.guild, force=True)
             await interaction.response.send_message("Bot reloaded on this guild!", ephemeral=True)
 
         await user.handle_restricted_interaction(interaction, ["reload"], handle_reload)
@@ -148,7 +300,7 @@ def init_commands(bot):
 
     @user_command_group.command(name="panel", description="Ticket bot (user) admin command")
     async def user_panel_command(interaction: Interaction, user: discord.User):
-        ticket_user = bot.get_user(interaction.user)
+        ticket_user = await bot.get_user(interaction.user)
 
         async def handle_user_panel():
             embed = Embed(title=user.global_name, description="User Management Panel")
@@ -158,7 +310,7 @@ def init_commands(bot):
 
     @user_command_group.command(name="setgroup", description="Set user a tickets group")
     async def user_group_set(interaction: Interaction, user: discord.User, group: str):
-        ticket_user = bot.get_user(interaction.user)
+        ticket_user = await bot.get_user(interaction.user)
 
         async def handle_user_panel_group():
             d_member = interaction.guild.get_member(user.id)
@@ -166,16 +318,79 @@ def init_commands(bot):
             if d_member is None:
                 await interaction.response.send_message("Provided user is not a member on this server!", ephemeral=True)
                 return
-            ticket_d_user = bot.get_user(d_member)
+            ticket_d_user = await bot.get_user(d_member)
             try:
                 ticket_d_user.set_role(group)
             except ValueError:
                 await interaction.response.send_message("Provided role does not exist!", ephemeral=True)
+                return
+            await ticket_d_user.save(bot.data_source)
+            await interaction.response.send_message(f"Group of {user.name} set to {group}!", ephemeral=True)
 
         await ticket_user.handle_restricted_interaction(interaction, ["user_panel_groups"], handle_user_panel_group)
 
+    roles_command_group = discord.app_commands.Group(name="roles", description="Ticket bot custom roles commands")
+
+    async def handle_roles_command(interaction: Interaction, modify_func, done_message: str):
+        ticket_user = await bot.get_user(interaction.user)
+
+        async def handle_roles_manage():
+            roles_inst = await bot.get_guild_roles(interaction.guild)
+            try:
+                modify_func(roles_inst)
+            except ValueError as e:
+                await interaction.response.send_message(str(e), ephemeral=True)
+                return
+            await roles_inst.save(bot.data_source)
+            await interaction.response.send_message(done_message, ephemeral=True)
+
+        await ticket_user.handle_restricted_interaction(interaction, ["roles_manage"], handle_roles_manage)
+
+    def parse_perms(perms: str):
+        return [perm.strip() for perm in perms.split(",") if len(perm.strip()) > 0]
+
+    @roles_command_group.command(name="create", description="Create custom tickets role")
+    async def roles_create(interaction: Interaction, role: str, name: str, perms: str = ""):
+        def modify(roles_inst):
+            if roles_inst.get(role) is not None:
+                raise ValueError("Provided role already exists!")
+            roles_inst.set_role(role, name, parse_perms(perms))
+
+        await handle_roles_command(interaction, modify, f"Role {role} created!")
+
+    @roles_command_group.command(name="edit", description="Edit custom tickets role")
+    async def roles_edit(interaction: Interaction, role: str, name: str, perms: str = ""):
+        def modify(roles_inst):
+            if roles_inst.custom.get(role) is None:
+                raise ValueError("Provided role does not exist!")
+            roles_inst.set_role(role, name, parse_perms(perms))
+
+        await handle_roles_command(interaction, modify, f"Role {role} edited!")
+
+    @roles_command_group.command(name="delete", description="Delete custom tickets role")
+    async def roles_delete(interaction: Interaction, role: str):
+        await handle_roles_command(
+            interaction, lambda roles_inst: roles_inst.delete_role(role),
+            f"Role {role} deleted!"
+        )
+
+    @roles_command_group.command(name="bind", description="Grant tickets role to everyone with a discord role")
+    async def roles_bind(interaction: Interaction, role: str, discord_role: discord.Role):
+        await handle_roles_command(
+            interaction, lambda roles_inst: roles_inst.bind_discord_role(role, discord_role.id),
+            f"Role {role} granted to {discord_role.name}!"
+        )
+
+    @roles_command_group.command(name="unbind", description="Stop granting tickets role with a discord role")
+    async def roles_unbind(interaction: Interaction, role: str, discord_role: discord.Role):
+        await handle_roles_command(
+            interaction, lambda roles_inst: roles_inst.bind_discord_role(role, discord_role.id, bind=False),
+            f"Role {role} no longer granted to {discord_role.name}!"
+        )
+
     """ Build the command tree """
     command_group.add_command(user_command_group)
+    command_group.add_command(roles_command_group)
     bot.commands.add_command(command_group)
 
 
@@ -0,0 +1,52 @@
+import os
+import argparse
+
+from dotenv import load_dotenv
+
+from source import create_data_source
+from table import TicketTable
+from user import default_role_id
+
+
+def strip_default_users(data_source) -> int:
+    """ Deletes stored users with the default role, they are implicit now """
+    users = data_source.load_prefix("user:")
+    default_users = [data_type for data_type, data in users.items() if data.get("role_id") == default_role_id]
+    if len(default_users) > 0:
+        data_source.delete_many(default_users)
+    return len(default_users)
+
+
+def ticket_table(data_source) -> TicketTable:
+    """ Loads all stored tickets into columns """
+    table = TicketTable()
+    for data_type, data in data_source.load_prefix("ticket:").items():
+        table.append_data(int(data_type.split(":")[1]), data)
+    return table
+
+
+def main():
+    """ Offline data file maintenance, run it while the bot is stopped """
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Compacts the ticket bot data")
+    parser.add_argument("--source", default=os.environ.get("DATA_SOURCE", "json"),
+                        choices=["json", "journal", "sqlite"], help="Data source type")
+    args = parser.parse_args()
+
+    data_source = create_data_source(args.source)
+    stripped = strip_default_users(data_source)
+    print(f"Stripped {stripped} default user records")
+    table = ticket_table(data_source)
+    open_count = sum(1 for _ in table.select(is_open=True))
+    print(f"{len(table)} stored tickets, {open_count} open, {len(table) - open_count} closed")
+    compact_func = getattr(data_source, "compact", None)
+    if compact_func is not None:
+        compact_func()
+    close_func = getattr(data_source, "close", None)
+    if close_func is not None:
+        close_func()
+
+
+if __name__ == "__main__":
+    main()
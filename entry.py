@@ -0,0 +1,94 @@
+import json
+import hashlib
+from typing import Any
+
+import discord
+from discord import Embed, SelectOption
+from discord.ui import View, Select
+
+import ticket
+from errors import TicketLimitReachedError
+from setup import TicketModal
+
+# Bump when the entry view changes, so existing entry messages are edited once
+entry_view_version = 1
+
+
+def entry_message_embed() -> Embed:
+    return Embed(
+        title="Create Ticket",
+        description="Click on button below to create new ticket channel!"
+    )
+
+
+def category_options():
+    return [
+        SelectOption(label=category.name, value=category.lc_name, description=category.description)
+        for category in ticket.categories
+    ]
+
+
+def entry_message_hash() -> str:
+    """ Hash of everything rendered in the entry message """
+    content = {
+        "version": entry_view_version,
+        "embed": entry_message_embed().to_dict(),
+        "options": [[o.label, o.value, o.description] for o in category_options()]
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+class EntryMessageView(View):
+    """
+    Persistent view of the entry messages of all guilds. It has no timeout and
+    stable custom_ids, so one instance registered with add_view at startup
+    handles entry messages sent by earlier runs.
+    """
+    bot: Any  # TicketBot
+
+    def __init__(self, bot):
+        super().__init__(timeout=None)
+        self.bot = bot
+
+    @discord.ui.select(cls=Select, custom_id="entry:category", placeholder="Select Category",
+                       options=category_options())
+    async def handle_select_category(self, interaction: discord.Interaction, select: Select):
+        """ Editing the message resets the selection """
+        await interaction.message.edit()
+        bot = self.bot
+        guild = interaction.guild
+        if not await bot.is_guild_prepared(guild):
+            await interaction.response.send_message(content="This guild is not set up!", ephemeral=True)
+            return
+        guild_settings = await bot.get_guild_settings(guild)
+        if not bot.can_open_ticket(guild.id, interaction.user.id):
+            await interaction.response.send_message(
+                content=f"You can have at most {guild_settings.max_open_tickets} open tickets!",
+                ephemeral=True
+            )
+            return
+        if guild_settings.setup_mode == "modal":
+            category_instance = ticket.get_category(select.values[0])
+
+            async def handle_modal_submit(modal_interaction: discord.Interaction, title, description):
+                await modal_interaction.response.defer(ephemeral=True, thinking=True)
+                try:
+                    ticket_instance = (await bot.create_ticket(
+                        guild=guild, user=modal_interaction.user,
+                        category=category_instance, title=title, description=description
+                    )).result()
+                except TicketLimitReachedError as e:
+                    await modal_interaction.followup.send(
+                        content=f"You can have at most {e.limit} open tickets!", ephemeral=True)
+                    return
+                await modal_interaction.followup.send(
+                    content=f"Ticket created, check <#{ticket_instance.channel_id}>!", ephemeral=True)
+
+            await interaction.response.send_modal(TicketModal(on_submit=handle_modal_submit))
+        else:
+            create_ticket_future = bot.create_ticket(guild=guild, user=interaction.user, category=select.values[0])
+            await interaction.response.send_message(
+                content="Ticket created, check tickets category!",
+                ephemeral=True
+            )
+            await create_ticket_future
@@ -1,3 +1,9 @@
 class InvalidGuildStateError(Exception):
     def __init__(self):
-        super().__init__()
\ No newline at end of file
+        super().__init__()
+
+
+class TicketLimitReachedError(Exception):
+    def __init__(self, limit: int):
+        super().__init__(f"Open tickets limit of {limit} reached")
+        self.limit = limit
@@ -1,5 +1,7 @@
+import asyncio
+import traceback
 from enum import Enum
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Set
 
 
 class EventTypes(Enum):
@@ -9,19 +11,62 @@ class EventTypes(Enum):
     ticket_reopen = "ticket_reopen"
 
 
+class OverflowPolicy(Enum):
+    block = "block"  # Emitter waits for a free slot
+    drop_oldest = "drop_oldest"  # Oldest queued event is dropped
+    reject = "reject"  # New event is dropped
+
+
+class Listener:
+    func: Any
+    priority: int  # Lower runs first
+    timeout: Optional[float]
+
+    def __init__(self, func, priority: int = 0, timeout: Optional[float] = None):
+        self.func = func
+        self.priority = priority
+        self.timeout = timeout
+
+
 class EventEmitter:
+    """
+    Calls event listeners. Listeners with the same priority run concurrently,
+    priorities run one after another from the lowest. A failing or timed out
+    listener is logged and does not affect the others.
+
+    Emitted events run in their own background task, or with start_queue on a
+    bounded queue consumed by a fixed pool of workers.
+    """
     holder: Any
-    listeners: Dict[EventTypes, List[Any]]
+    listeners: Dict[EventTypes, List[Listener]]
+    concurrent: bool
+    default_timeout: Optional[float]
+    tasks: Set[asyncio.Task]
+    queue: Optional[asyncio.Queue]
+    overflow: OverflowPolicy
+    workers: List[asyncio.Task]
+    dropped: int
+    rejected: int
 
-    def __init__(self, holder):
+    def __init__(self, holder, concurrent: bool = True, default_timeout: Optional[float] = 30):
         self.holder = holder
         self.listeners = {}
+        self.concurrent = concurrent
+        self.default_timeout = default_timeout
+        self.tasks = set()
+        self.queue = None
+        self.overflow = OverflowPolicy.block
+        self.workers = []
+        self.dropped = 0
+        self.rejected = 0
 
-    def handler(self, event_name: EventTypes):
+    def handler(self, event_name: EventTypes, priority: int = 0, timeout: Optional[float] = None):
         def decorator_handler(func):
             if self.listeners.get(event_name) is None:
                 self.listeners[event_name] = []
-            self.listeners.get(event_name).append(func)
+            listeners = self.listeners.get(event_name)
+            listeners.append(Listener(func, priority=priority, timeout=timeout))
+            listeners.sort(key=lambda listener: listener.priority)
 
             return func
 
@@ -29,5 +74,77 @@ class EventEmitter:
 
     async def call(self, event_name: EventTypes, event: Any):
         listeners = self.listeners.get(event_name)
-        if listeners is not None:
-            [await listener(self.holder, event) for listener in listeners]
+        if listeners is None:
+            return
+        if not self.concurrent:
+            [await self.run_listener(event_name, listener, event) for listener in listeners]
+            return
+        index = 0
+        while index < len(listeners):
+            priority = listeners[index].priority
+            group = []
+            while index < len(listeners) and listeners[index].priority == priority:
+                group.append(listeners[index])
+                index += 1
+            await asyncio.gather(*[self.run_listener(event_name, listener, event) for listener in group])
+
+    async def run_listener(self, event_name: EventTypes, listener: Listener, event: Any):
+        timeout = listener.timeout if listener.timeout is not None else self.default_timeout
+        try:
+            await asyncio.wait_for(listener.func(self.holder, event), timeout)
+        except asyncio.TimeoutError:
+            print(f"Listener {listener.func.__name__} of {event_name.value} timed out after {timeout}s")
+        except Exception:
+            print(f"Listener {listener.func.__name__} of {event_name.value} failed:")
+            traceback.print_exc()
+
+    def start_queue(self, workers: int = 4, max_size: int = 1000, overflow: OverflowPolicy = OverflowPolicy.block):
+        """ Switches emit to a bounded queue consumed by a pool of worker tasks """
+        if self.queue is not None:
+            return
+        self.queue = asyncio.Queue(maxsize=max_size)
+        self.overflow = overflow
+        loop = asyncio.get_running_loop()
+        self.workers = [loop.create_task(self.worker()) for _ in range(workers)]
+
+    async def worker(self):
+        while True:
+            event_name, event = await self.queue.get()
+            try:
+                await self.call(event_name, event)
+            finally:
+                self.queue.task_done()
+
+    async def emit(self, event_name: EventTypes, event: Any) -> bool:
+        """
+        Calls the listeners in the background, so the caller does not wait for them.
+        Returns False if the event was rejected because the queue is full.
+        """
+        if self.queue is None:
+            task = asyncio.get_running_loop().create_task(self.call(event_name, event))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+            return True
+        if self.queue.full():
+            if self.overflow == OverflowPolicy.reject:
+                self.rejected += 1
+                print(f"Event queue is full, rejected {event_name.value}")
+                return False
+            if self.overflow == OverflowPolicy.drop_oldest:
+                dropped_name, _ = self.queue.get_nowait()
+                self.queue.task_done()
+                self.dropped += 1
+                print(f"Event queue is full, dropped {dropped_name.value}")
+        await self.queue.put((event_name, event))
+        return True
+
+    async def drain(self):
+        """ Waits for all emitted events, then stops the queue workers """
+        while len(self.tasks) > 0:
+            await asyncio.gather(*self.tasks)
+        if self.queue is not None:
+            await self.queue.join()
+            [worker.cancel() for worker in self.workers]
+            await asyncio.gather(*self.workers, return_exceptions=True)
+            self.workers = []
+            self.queue = None
@@ -1,13 +1,16 @@
 import os
 
 import asyncio
+import traceback
 import discord
 from dotenv import load_dotenv
 
 from client import TicketBot
+from event import OverflowPolicy
 from commands import init_commands
 from setup import setups
-from source import JsonDataSource
+from source import create_data_source
+from ticket import transition_stats
 
 
 async def main():
@@ -20,14 +23,45 @@ async def main():
     intents.messages = True
     intents.message_content = True
 
-    client = TicketBot(intents=intents, data_source=JsonDataSource("data.json"))
+    idle_guild_ttl = os.environ.get("IDLE_GUILD_TTL")
+    archive_after_days = os.environ.get("ARCHIVE_AFTER_DAYS")
+    client = TicketBot(
+        intents=intents,
+        data_source=create_data_source(os.environ.get("DATA_SOURCE", "json")),
+        lazy_hydration=os.environ.get("LAZY_HYDRATION") == "1",
+        idle_guild_ttl=float(idle_guild_ttl) if idle_guild_ttl is not None else None,
+        event_workers=int(os.environ.get("EVENT_WORKERS", "0")),
+        event_overflow=OverflowPolicy(os.environ.get("EVENT_OVERFLOW", "block")),
+        transcript_dir=os.environ.get("TRANSCRIPT_DIR", "transcripts"),
+        transcript_on_close=os.environ.get("TRANSCRIPT_ON_CLOSE") == "1",
+        archive_after=float(archive_after_days) * 86400 if archive_after_days is not None else None,
+        bootstrap_concurrency=int(os.environ.get("BOOTSTRAP_CONCURRENCY", "16"))
+    )
     commands = discord.app_commands.CommandTree(client)
     client.commands = commands
     init_commands(client)
 
     async def handle_exit():
+        """ Pending saves are written by the final flush only, a failing step must not skip it """
         print("Cancelling setups...")
-        [await setup.cancel() for setup in setups]
+        for setup in list(setups):
+            try:
+                await setup.cancel()
+            except Exception:
+                traceback.print_exc()
+        for stop in [client.events.drain, client.rest.stop, client.transcripts.stop]:
+            try:
+                await stop()
+            except Exception:
+                traceback.print_exc()
+        print("Flushing data...")
+        await client.data_source.close()
+        if client.archive is not None:
+            client.archive.close()
+        data_source = client.data_source
+        print(f"Wrote {data_source.records_written} records ({data_source.bytes_written} bytes) "
+              f"in {data_source.flushes} flushes")
+        print(transition_stats)
 
     try:
         await client.start(os.environ.get("BOT_TOKEN"))
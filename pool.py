@@ -0,0 +1,125 @@
+import random
+import asyncio
+import traceback
+from typing import Any, Dict, List, Optional
+
+import discord
+from discord import NotFound
+
+import source
+from scheduler import Priority
+from settings import GuildSettings
+
+
+class ChannelPool:
+    """
+    Per guild pools of hidden text channels created ahead of time in the prepare
+    tickets category, with its permissions plus access for the bot. Claiming a
+    pooled channel replaces the channel creation of a new ticket with an edit.
+    Pools are refilled in the background up to the guild's channel_pool_size
+    and stored as channel_pool:{guild_id}.
+    """
+    client: Any  # TicketBot
+    pools: Dict[int, List[int]]  # Guild ID -> pooled channel IDs
+    refills: Dict[int, asyncio.Task]
+    claimed: int
+    misses: int
+
+    def __init__(self, client):
+        self.client = client
+        self.pools = {}
+        self.refills = {}
+        self.claimed = 0
+        self.misses = 0
+
+    async def get_pool(self, guild_id: int) -> List[int]:
+        pool = self.pools.get(guild_id)
+        if pool is None:
+            pool = await self.client.data_source.load(source.DataTypes.channel_pool(guild_id)) or []
+            pool = self.pools.setdefault(guild_id, pool)
+        return pool
+
+    async def save(self, guild_id: int, pool: List[int]):
+        await self.client.data_source.save(source.DataTypes.channel_pool(guild_id), list(pool))
+
+    def unload(self, guild_id: int):
+        self.pools.pop(guild_id, None)
+
+    async def claim(self, guild: discord.Guild, settings: GuildSettings) -> Optional[discord.TextChannel]:
+        """ Takes a pooled channel out of the pool, None if the pool is empty """
+        if settings.channel_pool_size <= 0:
+            return None
+        pool = await self.get_pool(guild.id)
+        channel = None
+        while channel is None and len(pool) > 0:
+            try:
+                channel = await self.client.resolver.channel(pool.pop(0), guild)
+            except NotFound:
+                pass
+        await self.save(guild.id, pool)
+        self.request_refill(guild, settings)
+        if channel is None:
+            self.misses += 1
+        else:
+            self.claimed += 1
+        return channel
+
+    def request_refill(self, guild: discord.Guild, settings: GuildSettings):
+        if guild.id not in self.refills:
+            task = asyncio.ensure_future(self.refill(guild, settings))
+            self.refills[guild.id] = task
+            task.add_done_callback(lambda _: self.refills.pop(guild.id, None))
+
+    async def refill(self, guild: discord.Guild, settings: GuildSettings):
+        try:
+            pool = await self.get_pool(guild.id)
+            if len(pool) >= settings.channel_pool_size:
+                return
+            prepare_category = await self.client.resolver.channel(settings.prepare_tickets_category, guild)
+            while len(pool) < settings.channel_pool_size:
+                channel = await self.client.rest.submit(
+                    guild.id, prepare_category.create_text_channel, priority=Priority.background,
+                    name=f"pool-{random.randint(0, 99999)}", overwrites={
+                        **prepare_category.overwrites,
+                        guild.default_role: discord.PermissionOverwrite(view_channel=False),
+                        guild.me: discord.PermissionOverwrite(view_channel=True, manage_channels=True)
+                    }
+                )
+                current = self.pools.get(guild.id)
+                if current is not None and current is not pool:
+                    """ Unloaded and loaded again meanwhile, adopt the channel into the loaded pool """
+                    pool = current
+                pool.append(channel.id)
+                await self.save(guild.id, pool)
+                if current is None:
+                    """ Unloaded meanwhile, the created channels are recorded in storage """
+                    return
+        except Exception:
+            print(f"Failed to refill channel pool of {guild.name}:")
+            traceback.print_exc()
+
+    async def reconcile(self, guild: discord.Guild, settings: GuildSettings):
+        """
+        Drops pooled channels that no longer exist or left the prepare category,
+        deletes channels beyond the pool size, then refills
+        """
+        pool = await self.get_pool(guild.id)
+        valid = []
+        for channel_id in pool:
+            channel = guild.get_channel(channel_id)
+            if channel is not None and channel.category_id == settings.prepare_tickets_category:
+                valid.append(channel)
+        size = max(settings.channel_pool_size, 0)
+        surplus = valid[size:]
+        valid = valid[:size]
+        if len(valid) != len(pool):
+            pool[:] = [channel.id for channel in valid]
+            await self.save(guild.id, pool)
+        for channel in surplus:
+            try:
+                await self.client.rest.submit(
+                    guild.id, channel.delete, priority=Priority.background, reason="Channel pool shrunk")
+            except NotFound:
+                pass
+        if settings.channel_pool_size > 0 and settings.is_prepared():
+            self.request_refill(guild, settings)
@@ -0,0 +1,155 @@
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+from ticket import Ticket
+
+
+class TicketRegistry:
+    """
+    Tickets by guild and channel plus secondary indexes by author, open state and
+    category, and the open and closed tickets ordered by activity (least recently
+    updated first). Indexes are kept in sync through add, update and remove.
+    """
+    tickets: Dict[int, Dict[int, Ticket]]  # Guild ID -> channel ID -> ticket
+    by_author: Dict[int, Dict[int, Set[int]]]  # Guild ID -> author ID -> channel IDs
+    open_by_author: Dict[int, Dict[int, Set[int]]]
+    open: Dict[int, Set[int]]
+    by_category: Dict[int, Dict[str, Set[int]]]
+    activity: Dict[int, "OrderedDict[int, float]"]  # Guild ID -> open channel ID -> updated_at
+    closed_activity: Dict[int, "OrderedDict[int, float]"]  # Guild ID -> closed channel ID -> updated_at
+    indexed: Dict[Tuple[int, int], Tuple[int, bool, Optional[str]]]  # Values the ticket is indexed under
+
+    def __init__(self):
+        self.tickets = {}
+        self.by_author = {}
+        self.open_by_author = {}
+        self.open = {}
+        self.by_category = {}
+        self.activity = {}
+        self.closed_activity = {}
+        self.indexed = {}
+
+    def add(self, ticket: Ticket):
+        guild_id = ticket.guild_id
+        channel_id = ticket.channel_id
+        if (guild_id, channel_id) in self.indexed:
+            self.unindex(guild_id, channel_id)
+        self.tickets.setdefault(guild_id, {})[channel_id] = ticket
+        category = ticket.category.lc_name if ticket.category is not None else None
+        self.by_author.setdefault(guild_id, {}).setdefault(ticket.author_id, set()).add(channel_id)
+        if ticket.is_open:
+            self.open_by_author.setdefault(guild_id, {}).setdefault(ticket.author_id, set()).add(channel_id)
+            self.open.setdefault(guild_id, set()).add(channel_id)
+        activity = (self.activity if ticket.is_open else self.closed_activity).setdefault(guild_id, OrderedDict())
+        activity[channel_id] = ticket.updated_at
+        activity.move_to_end(channel_id)
+        self.by_category.setdefault(guild_id, {}).setdefault(category, set()).add(channel_id)
+        self.indexed[(guild_id, channel_id)] = (ticket.author_id, ticket.is_open, category)
+
+    def update(self, ticket: Ticket):
+        """ Re-indexes a ticket after it changed """
+        self.add(ticket)
+
+    def touch(self, ticket: Ticket):
+        """ Moves the ticket to the end of the activity order after only updated_at changed """
+        activity = (self.activity if ticket.is_open else self.closed_activity).get(ticket.guild_id)
+        if activity is not None and ticket.channel_id in activity:
+            activity[ticket.channel_id] = ticket.updated_at
+            activity.move_to_end(ticket.channel_id)
+
+    def remove(self, guild_id: int, channel_id: int) -> Optional[Ticket]:
+        ticket = self.tickets.get(guild_id, {}).pop(channel_id, None)
+        if ticket is not None:
+            self.unindex(guild_id, channel_id)
+        return ticket
+
+    def unindex(self, guild_id: int, channel_id: int):
+        author_id, is_open, category = self.indexed.pop((guild_id, channel_id))
+        self.discard(self.by_author[guild_id], author_id, channel_id)
+        if is_open:
+            self.discard(self.open_by_author[guild_id], author_id, channel_id)
+            self.open[guild_id].discard(channel_id)
+        (self.activity if is_open else self.closed_activity)[guild_id].pop(channel_id, None)
+        self.discard(self.by_category[guild_id], category, channel_id)
+
+    @staticmethod
+    def discard(index, key, channel_id: int):
+        channel_ids = index.get(key)
+        if channel_ids is not None:
+            channel_ids.discard(channel_id)
+            if len(channel_ids) == 0:
+                del index[key]
+
+    def get(self, guild_id: int, channel_id: int) -> Optional[Ticket]:
+        return self.tickets.get(guild_id, {}).get(channel_id)
+
+    def guild(self, guild_id: int) -> Dict[int, Ticket]:
+        return self.tickets.get(guild_id, {})
+
+    def unload_guild(self, guild_id: int):
+        for channel_id in list(self.guild(guild_id)):
+            self.remove(guild_id, channel_id)
+        for index in [self.tickets, self.by_author, self.open_by_author, self.open, self.by_category, self.activity,
+                      self.closed_activity]:
+            index.pop(guild_id, None)
+
+    def count_open(self, guild_id: int, author_id: int) -> int:
+        return len(self.open_by_author.get(guild_id, {}).get(author_id, ()))
+
+    def count(self, guild_id: int, is_open: Optional[bool] = None) -> int:
+        total = len(self.guild(guild_id))
+        if is_open is None:
+            return total
+        open_count = len(self.open.get(guild_id, ()))
+        return open_count if is_open else total - open_count
+
+    def least_active(self, guild_id: int, before: float, is_open: bool = True) -> List[Ticket]:
+        """ Open or closed tickets last updated before the timestamp, least recently updated first """
+        guild_tickets = self.guild(guild_id)
+        tickets = []
+        for channel_id, updated_at in (self.activity if is_open else self.closed_activity).get(guild_id, {}).items():
+            if updated_at >= before:
+                break
+            tickets.append(guild_tickets[channel_id])
+        return tickets
+
+    def query(self,
+              guild_id: int,
+              author_id: Optional[int] = None,
+              is_open: Optional[bool] = None,
+              category: Optional[str] = None,
+              created_after: Optional[float] = None,
+              created_before: Optional[float] = None,
+              updated_before: Optional[float] = None,
+              limit: Optional[int] = None) -> List[Ticket]:
+        """ Tickets matching all given filters, starts from the smallest matching index """
+        candidates: List[Set[int]] = []
+        if author_id is not None:
+            index = self.open_by_author if is_open else self.by_author
+            candidates.append(index.get(guild_id, {}).get(author_id, set()))
+        if is_open:
+            candidates.append(self.open.get(guild_id, set()))
+        if category is not None:
+            candidates.append(self.by_category.get(guild_id, {}).get(category, set()))
+        guild_tickets = self.guild(guild_id)
+        channel_ids = min(candidates, key=len) if len(candidates) > 0 else guild_tickets.keys()
+
+        results = []
+        for channel_id in channel_ids:
+            ticket = guild_tickets[channel_id]
+            if author_id is not None and ticket.author_id != author_id:
+                continue
+            if is_open is not None and ticket.is_open != is_open:
+                continue
+            if category is not None and (ticket.category is None or ticket.category.lc_name != category):
+                continue
+            if created_after is not None and ticket.created_at < created_after:
+                continue
+            if created_before is not None and ticket.created_at >= created_before:
+                continue
+            if updated_before is not None and ticket.updated_at >= updated_before:
+                continue
+            results.append(ticket)
+            if limit is not None and len(results) >= limit:
+                break
+        return results
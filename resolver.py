@@ -0,0 +1,55 @@
+import asyncio
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import discord
+
+from scheduler import count_rest_call
+
+
+class Resolver:
+    """
+    Resolves channels and members from the gateway cache and fetches them only
+    on a miss. Concurrent fetches of the same object share one REST call.
+    """
+    client: discord.Client
+    inflight: Dict[Tuple[str, Hashable], asyncio.Future]
+    cache_hits: int
+    rest_calls: Dict[str, int]  # Fetches by kind
+
+    def __init__(self, client: discord.Client):
+        self.client = client
+        self.inflight = {}
+        self.cache_hits = 0
+        self.rest_calls = {}
+
+    async def fetch(self, kind: str, key: Hashable, fetch_func: Callable[[], Any]):
+        future = self.inflight.get((kind, key))
+        if future is None:
+            self.rest_calls[kind] = self.rest_calls.get(kind, 0) + 1
+            count_rest_call()
+            future = asyncio.ensure_future(fetch_func())
+            self.inflight[(kind, key)] = future
+            future.add_done_callback(lambda _: self.inflight.pop((kind, key), None))
+        return await asyncio.shield(future)
+
+    async def channel(self, channel_id: int, guild: Optional[discord.Guild] = None):
+        channel = guild.get_channel(channel_id) if guild is not None else self.client.get_channel(channel_id)
+        if channel is not None:
+            self.cache_hits += 1
+            return channel
+        return await self.fetch("channel", channel_id, lambda: self.client.fetch_channel(channel_id))
+
+    async def member(self, guild: discord.Guild, user_id: int) -> discord.Member:
+        member = guild.get_member(user_id)
+        if member is not None:
+            self.cache_hits += 1
+            return member
+        return await self.fetch("member", (guild.id, user_id), lambda: guild.fetch_member(user_id))
+
+    @staticmethod
+    def message(channel: discord.TextChannel, message_id: int) -> discord.PartialMessage:
+        """ Message handle to edit or delete without fetching it first """
+        return channel.get_partial_message(message_id)
+
+    def total_rest_calls(self) -> int:
+        return sum(self.rest_calls.values())
@@ -0,0 +1,212 @@
+import time
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Any, Deque, Dict, Hashable, List, Optional
+
+
+class Priority(IntEnum):
+    user = 0  # User facing ticket creation
+    state = 1  # Ticket state changes
+    background = 2  # Cleanup and maintenance
+
+
+# REST call counter of the measured operation running in this context, shared with its child tasks
+operation_rest_calls: ContextVar[Optional[List[int]]] = ContextVar("operation_rest_calls", default=None)
+
+
+def count_rest_call():
+    counter = operation_rest_calls.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+class OperationStats:
+    """ REST calls and wall time of one kind of operation, each run is measured with measure() """
+    name: str
+    runs: int
+    rest_calls: int
+    total_time: float
+    max_time: float
+    last_rest_calls: int
+    last_time: float
+
+    def __init__(self, name: str):
+        self.name = name
+        self.runs = 0
+        self.rest_calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.last_rest_calls = 0
+        self.last_time = 0.0
+
+    @contextmanager
+    def measure(self):
+        counter = [0]
+        token = operation_rest_calls.set(counter)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            operation_rest_calls.reset(token)
+            self.last_time = time.perf_counter() - started
+            self.last_rest_calls = counter[0]
+            self.runs += 1
+            self.rest_calls += self.last_rest_calls
+            self.total_time += self.last_time
+            self.max_time = max(self.max_time, self.last_time)
+
+    def __str__(self):
+        if self.runs == 0:
+            return f"{self.name}: no runs"
+        return (f"{self.name}: {self.runs} runs, {self.rest_calls / self.runs:.1f} REST calls and "
+                f"{self.total_time / self.runs * 1000:.0f} ms on average, {self.max_time * 1000:.0f} ms max")
+
+
+class RestJob:
+    guild_id: int
+    priority: Priority
+    func: Any
+    kwargs: Dict[str, Any]
+    coalesce_key: Optional[Hashable]
+    future: asyncio.Future
+    queued_at: float
+
+    def __init__(self, guild_id: int, priority: Priority, func, kwargs, coalesce_key: Optional[Hashable]):
+        self.guild_id = guild_id
+        self.priority = priority
+        self.func = func
+        self.kwargs = kwargs
+        self.coalesce_key = coalesce_key
+        self.future = asyncio.get_running_loop().create_future()
+        self.queued_at = time.monotonic()
+
+
+class RestScheduler:
+    """
+    Runs outgoing ticket REST operations with bounded concurrency.
+
+    Jobs are queued per priority class and guild. Workers always serve the most
+    important class with work, and within a class take guilds round-robin, so a
+    burst in one guild does not starve the others. A guild never runs more than
+    per_guild_concurrency jobs at once. Jobs submitted with a coalesce key that is
+    still queued are merged into the queued job, their kwargs update its kwargs
+    and a more important priority moves it to that class.
+    """
+    concurrency: int
+    per_guild_concurrency: int
+    queues: Dict[Priority, "OrderedDict[int, Deque[RestJob]]"]
+    queued: Dict[Hashable, RestJob]  # Coalesce key -> queued job
+    running: Dict[int, int]  # Guild ID -> running jobs
+    workers: List[asyncio.Task]
+
+    # Stats per priority class
+    completed: Dict[Priority, int]
+    coalesced: int
+    max_wait: Dict[Priority, float]
+
+    def __init__(self, concurrency: int = 8, per_guild_concurrency: int = 2):
+        self.concurrency = concurrency
+        self.per_guild_concurrency = per_guild_concurrency
+        self.queues = {priority: OrderedDict() for priority in Priority}
+        self.queued = {}
+        self.running = {}
+        self.workers = []
+        self.condition = None
+        self.completed = {priority: 0 for priority in Priority}
+        self.coalesced = 0
+        self.max_wait = {priority: 0.0 for priority in Priority}
+
+    def start(self):
+        if len(self.workers) > 0:
+            return
+        self.condition = asyncio.Condition()
+        loop = asyncio.get_running_loop()
+        self.workers = [loop.create_task(self.worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        [worker.cancel() for worker in self.workers]
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    async def submit(self,
+                     guild_id: int,
+                     func,
+                     priority: Priority = Priority.background,
+                     coalesce_key: Optional[Hashable] = None,
+                     **kwargs):
+        """ Queues func(**kwargs) and returns its result once it ran """
+        if len(self.workers) == 0:
+            count_rest_call()
+            return await func(**kwargs)
+        if coalesce_key is not None and coalesce_key in self.queued:
+            job = self.queued[coalesce_key]
+            job.kwargs.update(kwargs)
+            if priority < job.priority:
+                self.promote(job, priority)
+            self.coalesced += 1
+            return await asyncio.shield(job.future)
+
+        count_rest_call()
+        job = RestJob(guild_id, priority, func, kwargs, coalesce_key)
+        self.queues[priority].setdefault(guild_id, deque()).append(job)
+        if coalesce_key is not None:
+            self.queued[coalesce_key] = job
+        async with self.condition:
+            self.condition.notify()
+        return await asyncio.shield(job.future)
+
+    def promote(self, job: RestJob, priority: Priority):
+        """ Moves a queued job to the back of its guild queue in a more important class """
+        ring = self.queues[job.priority]
+        jobs = ring[job.guild_id]
+        jobs.remove(job)
+        if len(jobs) == 0:
+            del ring[job.guild_id]
+        job.priority = priority
+        self.queues[priority].setdefault(job.guild_id, deque()).append(job)
+
+    def pick(self) -> Optional[RestJob]:
+        for priority in Priority:
+            ring = self.queues[priority]
+            for _ in range(len(ring)):
+                guild_id, jobs = next(iter(ring.items()))
+                ring.move_to_end(guild_id)
+                if self.running.get(guild_id, 0) >= self.per_guild_concurrency:
+                    continue
+                job = jobs.popleft()
+                if len(jobs) == 0:
+                    del ring[guild_id]
+                if job.coalesce_key is not None:
+                    self.queued.pop(job.coalesce_key, None)
+                self.running[guild_id] = self.running.get(guild_id, 0) + 1
+                return job
+        return None
+
+    async def worker(self):
+        while True:
+            async with self.condition:
+                job = self.pick()
+                while job is None:
+                    await self.condition.wait()
+                    job = self.pick()
+            wait = time.monotonic() - job.queued_at
+            self.max_wait[job.priority] = max(self.max_wait[job.priority], wait)
+            try:
+                job.future.set_result(await job.func(**job.kwargs))
+            except asyncio.CancelledError:
+                job.future.cancel()
+                raise
+            except Exception as e:
+                job.future.set_exception(e)
+            finally:
+                self.completed[job.priority] += 1
+                async with self.condition:
+                    running = self.running[job.guild_id] - 1
+                    if running > 0:
+                        self.running[job.guild_id] = running
+                    else:
+                        del self.running[job.guild_id]
+                    self.condition.notify_all()
@@ -1,17 +1,36 @@
+# How the ticket details are collected, channel: questions in a preparing channel, modal: single form
+setup_modes = ["channel", "modal"]
+
+
 class GuildSettings:
+    __slots__ = (
+        "entry_channel", "entry_message", "prepare_tickets_category", "tickets_category", "closed_tickets_category",
+        "entry_message_hash", "setup_mode", "channel_pool_size", "max_open_tickets", "auto_close_hours"
+    )
     entry_channel: int
     entry_message: int
+    entry_message_hash: str  # Content hash of the entry message, it is edited when this changes
     prepare_tickets_category: int
     tickets_category: int
     closed_tickets_category: int
+    setup_mode: str
+    channel_pool_size: int  # Pre-created ticket channels, 0 disables the pool
+    max_open_tickets: int  # Open tickets per user, 0 is unlimited
+    auto_close_hours: float  # Open tickets without activity this long are closed, 0 disables
 
     def __init__(self, data=None):
         if data is not None:
             self.entry_channel = data.get("entry_channel")
             self.entry_message = data.get("entry_message")
+            self.entry_message_hash = data.get("entry_message_hash")
             self.prepare_tickets_category = data.get("prepare_tickets_category")
             self.tickets_category = data.get("tickets_category")
             self.closed_tickets_category = data.get("closed_tickets_category")
+            setup_mode = data.get("setup_mode")
+            self.setup_mode = setup_mode if setup_mode in setup_modes else setup_modes[0]
+            self.channel_pool_size = data.get("channel_pool_size") or 0
+            self.max_open_tickets = data.get("max_open_tickets") or 0
+            self.auto_close_hours = data.get("auto_close_hours") or 0
 
     def is_prepared(self) -> bool:
         guild_settings_req = [
@@ -25,9 +44,14 @@ class GuildSettings:
         return {
             "entry_channel": self.entry_channel,
             "entry_message": self.entry_message,
+            "entry_message_hash": self.entry_message_hash,
             "prepare_tickets_category": self.prepare_tickets_category,
             "tickets_category": self.tickets_category,
-            "closed_tickets_category": self.closed_tickets_category
+            "closed_tickets_category": self.closed_tickets_category,
+            "setup_mode": self.setup_mode,
+            "channel_pool_size": self.channel_pool_size,
+            "max_open_tickets": self.max_open_tickets,
+            "auto_close_hours": self.auto_close_hours
         }
 
 
@@ -1,7 +1,10 @@
+import time
+import heapq
 import string
 import random
-import json
-from typing import Dict, Any, List
+import asyncio
+import traceback
+from typing import Dict, Any, List, Optional, Tuple
 
 import discord
 
@@ -13,53 +16,215 @@ class Context:
 
 
 class Part:
+    timeout: Optional[float] = None  # Seconds to answer, setup timeout is used if None
+
     async def run(self, ctx: Context, next_func, cancel_func):
         """ Run setup part in channel """
         pass
 
+    def cleanup(self, ctx: Context):
+        """ Removes latches of the part when the setup is cancelled while it runs """
+        pass
+
+
+class InputLatches:
+    """ Message handlers of running setups keyed by (channel_id, user_id) """
+    latches: Dict[Tuple[int, int], Any]
+    channels: Dict[int, int]  # Channel ID -> count of latches in it
+
+    def __init__(self):
+        self.latches = {}
+        self.channels = {}
 
-input_latches: Dict[Context, Any] = {}
-option_latches: Dict[str, Any] = {}
+    def add(self, ctx: Context, handler):
+        key = (ctx.channel.id, ctx.user.id)
+        if key not in self.latches:
+            self.channels[ctx.channel.id] = self.channels.get(ctx.channel.id, 0) + 1
+        self.latches[key] = handler
+
+    def remove(self, ctx: Context):
+        if self.latches.pop((ctx.channel.id, ctx.user.id), None) is None:
+            return
+        remaining = self.channels[ctx.channel.id] - 1
+        if remaining > 0:
+            self.channels[ctx.channel.id] = remaining
+        else:
+            del self.channels[ctx.channel.id]
+
+    def has_channel(self, channel_id: int) -> bool:
+        return channel_id in self.channels
+
+    def get(self, channel_id: int, user_id: int):
+        return self.latches.get((channel_id, user_id))
+
+    def __len__(self):
+        return len(self.latches)
+
+
+input_latches = InputLatches()
+
+
+class ComponentRouter:
+    """
+    Maps custom_id of setup components directly to their handler. All custom_ids
+    of one prompt form a group, which is removed once any of them is used.
+    """
+    custom_id_prefix = "setup:"
+    routes: Dict[str, Tuple[int, Any]]  # custom_id -> (group ID, handler)
+    groups: Dict[int, List[str]]
+    next_group_id: int
+    routed: int
+    unrouted: int
+
+    def __init__(self):
+        self.routes = {}
+        self.groups = {}
+        self.next_group_id = 0
+        self.routed = 0
+        self.unrouted = 0
+
+    def create_custom_id(self) -> str:
+        letters = string.ascii_lowercase
+        return self.custom_id_prefix + "".join(random.choice(letters) for _ in range(10))
+
+    def add_group(self, custom_ids: List[str], handler) -> int:
+        group_id = self.next_group_id
+        self.next_group_id += 1
+        self.groups[group_id] = custom_ids
+        for custom_id in custom_ids:
+            self.routes[custom_id] = (group_id, handler)
+        return group_id
+
+    def remove_group(self, group_id: int):
+        for custom_id in self.groups.pop(group_id, []):
+            self.routes.pop(custom_id, None)
+
+    async def route(self, custom_id: str) -> bool:
+        """ Calls the handler of custom_id, returns False if it is not a setup component """
+        route = self.routes.get(custom_id) if custom_id.startswith(self.custom_id_prefix) else None
+        if route is None:
+            self.unrouted += 1
+            return False
+        self.routed += 1
+        group_id, handler = route
+        self.remove_group(group_id)
+        await handler(custom_id)
+        return True
+
+    def __len__(self):
+        return len(self.groups)
+
+
+option_latches = ComponentRouter()
 setups = []
 
 
+class SetupScheduler:
+    """
+    Cancels setups whose current part was not answered in time. Deadlines live
+    in one heap served by a single task, rescheduling leaves the old heap entry
+    behind to be skipped.
+    """
+    heap: List[Tuple[float, int, Any]]
+    deadlines: Dict[Any, int]  # ChannelSetup -> sequence of its current heap entry
+    sequence: int
+    expired: int
+
+    def __init__(self):
+        self.heap = []
+        self.deadlines = {}
+        self.sequence = 0
+        self.expired = 0
+        self.task = None
+        self.wakeup = None
+
+    @property
+    def live(self) -> int:
+        return len(self.deadlines)
+
+    def schedule(self, setup, timeout: float):
+        self.sequence += 1
+        self.deadlines[setup] = self.sequence
+        deadline = time.monotonic() + timeout
+        heapq.heappush(self.heap, (deadline, self.sequence, setup))
+        if self.task is None:
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.get_running_loop().create_task(self.run())
+        elif self.heap[0][1] == self.sequence:
+            """ New earliest deadline """
+            self.wakeup.set()
+
+    def unschedule(self, setup):
+        self.deadlines.pop(setup, None)
+
+    async def run(self):
+        while True:
+            while len(self.heap) > 0 and self.deadlines.get(self.heap[0][2]) != self.heap[0][1]:
+                heapq.heappop(self.heap)
+            timeout = self.heap[0][0] - time.monotonic() if len(self.heap) > 0 else None
+            if timeout is None or timeout > 0:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, _, setup = heapq.heappop(self.heap)
+            del self.deadlines[setup]
+            self.expired += 1
+            try:
+                await setup.cancel()
+            except Exception:
+                print("Failed to cancel expired setup:")
+                traceback.print_exc()
+
+
+setup_scheduler = SetupScheduler()
+
+
 class InputPart(Part):
     key: str
     message_args: Any
 
-    def __init__(self, key: str, **message_args):
+    def __init__(self, key: str, timeout: float = None, **message_args):
         self.key = key
+        self.timeout = timeout
         self.message_args = message_args
 
     async def run(self, ctx: Context, next_func, cancel_func):
         sent_message = await ctx.channel.send(**self.message_args)
 
         async def move_next(message: discord.Message):
-            del input_latches[ctx]
+            input_latches.remove(ctx)
             ctx.data[self.key] = message.content
             await message.delete()
             await sent_message.delete()
             await next_func()
 
-        input_latches[ctx] = move_next
+        input_latches.add(ctx, move_next)
+
+    def cleanup(self, ctx: Context):
+        input_latches.remove(ctx)
 
 
 class OptionsPart(Part):
     key: str
     options: List[str]
     message_args: Any
+    group_id: Optional[int]
 
-    def __init__(self, key: str, options: List[str] = None, **kwargs):
+    def __init__(self, key: str, options: List[str] = None, timeout: float = None, **kwargs):
         self.key = key
         self.options = options or []
+        self.timeout = timeout
         self.message_args = kwargs
+        self.group_id = None
 
     async def run(self, ctx: Context, next_func, cancel_func):
         options_view = discord.ui.View()
         button_maps: Dict[str, str] = {}
         for option in self.options:
-            letters = string.ascii_lowercase
-            custom_id = "".join(random.choice(letters) for _ in range(10))
+            custom_id = option_latches.create_custom_id()
             button_maps[custom_id] = option
             button = discord.ui.Button(
                 style=discord.ButtonStyle.gray, label=option, custom_id=custom_id)
@@ -67,16 +232,31 @@ class OptionsPart(Part):
 
         sent_message = await ctx.channel.send(view=options_view, **self.message_args)
 
-        option_latch_keys = [*button_maps.keys()]
-
         async def handle_button_click(button_custom_id: str):
-            del option_latches[json.dumps(option_latch_keys)]
             option_selected = button_maps[button_custom_id]
             ctx.data[self.key] = option_selected
             await sent_message.delete()
             await next_func()
 
-        option_latches[json.dumps(option_latch_keys)] = handle_button_click
+        self.group_id = option_latches.add_group([*button_maps.keys()], handle_button_click)
+
+    def cleanup(self, ctx: Context):
+        if self.group_id is not None:
+            option_latches.remove_group(self.group_id)
+
+
+class TicketModal(discord.ui.Modal, title="Create Ticket"):
+    """ Collects all ticket details at once, replaces the channel setup in modal setup mode """
+    problem_title = discord.ui.TextInput(label="Problem Title", max_length=100)
+    problem_description = discord.ui.TextInput(
+        label="Problem Description", style=discord.TextStyle.paragraph, max_length=1000)
+
+    def __init__(self, on_submit: Any):
+        super().__init__()
+        self.on_submit_func = on_submit
+
+    async def on_submit(self, interaction: discord.Interaction):
+        await self.on_submit_func(interaction, self.problem_title.value, self.problem_description.value)
 
 
 class ChannelSetup:
@@ -85,13 +265,15 @@ class ChannelSetup:
     index: int
     on_done_func: Any
     finished: bool
+    timeout: float  # Seconds to answer a part
 
     def __init__(
             self,
             channel: discord.TextChannel,
             user: discord.User,
             on_done: Any,
-            parts: List[Part] = None
+            parts: List[Part] = None,
+            timeout: float = 15 * 60
     ):
         context = Context()
         context.channel = channel
@@ -102,6 +284,7 @@ class ChannelSetup:
         self.index = -1
         self.on_done_func = on_done
         self.finished = False
+        self.timeout = timeout
 
     def add_part(self, part: Part):
         self.parts.append(part)
@@ -116,6 +299,7 @@ class ChannelSetup:
 
             if self.index + 1 >= len(self.parts):
                 setups.remove(self)
+                setup_scheduler.unschedule(self)
                 self.finished = True
                 await self.on_done_func(0, self.context)
                 return
@@ -123,6 +307,7 @@ class ChannelSetup:
             self.index += 1
 
             part = self.parts[self.index]
+            setup_scheduler.schedule(self, part.timeout or self.timeout)
             await part.run(self.context, next_func, self.cancel)
 
         setups.append(self)
@@ -134,5 +319,8 @@ class ChannelSetup:
             return
 
         setups.remove(self)
+        setup_scheduler.unschedule(self)
         self.finished = True
+        if 0 <= self.index < len(self.parts):
+            self.parts[self.index].cleanup(self.context)
         await self.on_done_func(1, self.context)
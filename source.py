@@ -1,17 +1,54 @@
-from typing import Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
 
 import os
 import json
+import sqlite3
+import asyncio
+import threading
+import traceback
 
 
 def user_type_func(gid: int, uid: int):
     return f"user:{gid}:{uid}"
 
 
+def settings_type_func(gid: int):
+    return f"settings:{gid}"
+
+
+def roles_type_func(gid: int):
+    return f"roles:{gid}"
+
+
+def channel_pool_type_func(gid: int):
+    return f"channel_pool:{gid}"
+
+
+def ticket_type_func(gid: int, cid: int):
+    return f"ticket:{gid}:{cid}"
+
+
+def guild_tickets_type_func(gid: int):
+    """ Prefix of all ticket keys in a guild, use with DataSource.load_prefix """
+    return f"ticket:{gid}:"
+
+
+def transcript_type_func(gid: int, cid: int):
+    return f"transcript:{gid}:{cid}"
+
+
 class DataTypes:
     tickets = "tickets"
-    settings = "settings"
+    settings = "settings"  # Legacy, all guilds in one record
     user = user_type_func
+    guild_settings = settings_type_func
+    guild_roles = roles_type_func
+    channel_pool = channel_pool_type_func
+    ticket = ticket_type_func
+    guild_tickets = guild_tickets_type_func
+    transcript = transcript_type_func  # Transcript export progress
+    transcripts = "transcript:"  # Prefix of all transcript keys
 
 
 class DataSource:
@@ -23,6 +60,25 @@ class DataSource:
         """ Loads the data """
         pass
 
+    def load_prefix(self, prefix: str) -> Dict[str, Any]:
+        """ Loads all data which type starts with prefix, keyed by data type """
+        pass
+
+    def save_many(self, data: Dict[str, Any]) -> int:
+        """ Saves multiple data types at once, returns the amount of bytes written """
+        for data_type in data:
+            self.save(data_type, data[data_type])
+        return sum(len(json.dumps(data[data_type])) for data_type in data)
+
+    def delete(self, data_type: str):
+        """ Deletes the data """
+        pass
+
+    def delete_many(self, data_types: List[str]):
+        """ Deletes multiple data types at once """
+        for data_type in data_types:
+            self.delete(data_type)
+
 
 class JsonDataSource(DataSource):
     path: str
@@ -38,6 +94,9 @@ class JsonDataSource(DataSource):
     def load(self, data_type: str) -> Any:
         return self.data.get(data_type)
 
+    def load_prefix(self, prefix: str) -> Dict[str, Any]:
+        return {k: v for k, v in self.data.items() if k.startswith(prefix)}
+
     def save(self, data_type: str, data: Any):
         with open(self.path, "w") as file:
             all_data = self.data
@@ -45,6 +104,22 @@ class JsonDataSource(DataSource):
             self.data = all_data
             file.write(json.dumps(all_data))
 
+    def save_many(self, data: Dict[str, Any]) -> int:
+        self.data.update(data)
+        dat = json.dumps(self.data)
+        with open(self.path, "w") as file:
+            file.write(dat)
+        return len(dat)
+
+    def delete(self, data_type: str):
+        self.delete_many([data_type])
+
+    def delete_many(self, data_types: List[str]):
+        for data_type in data_types:
+            self.data.pop(data_type, None)
+        with open(self.path, "w") as file:
+            file.write(json.dumps(self.data))
+
     def load_all(self, retries=1):
         dat: str
         with open(self.path, "r+") as file:
@@ -64,3 +139,449 @@ class JsonDataSource(DataSource):
     def recreate_file(self):
         with open(self.path, "w+") as file:
             file.write("{}")
+
+
+class JournaledDataSource(DataSource):
+    """
+    Snapshot file plus an append-only journal of per-key mutations.
+
+    Every save appends a single record to the journal and fsyncs it, so a write
+    costs the size of the saved value only. Once the journal grows past
+    compact_threshold bytes it is folded into the snapshot on a background thread.
+    The snapshot has the same format as JsonDataSource's data file.
+    """
+    path: str
+    log_path: str
+    old_log_path: str
+    data: Dict[str, Any]
+    compact_threshold: int
+    compacting: bool
+
+    def __init__(self, file_name: str, compact_threshold: int = 4 * 1024 * 1024):
+        self.path = f"{os.getcwd()}/{file_name}"
+        self.log_path = f"{self.path}.log"
+        self.old_log_path = f"{self.path}.log.old"
+        self.compact_threshold = compact_threshold
+        self.compacting = False
+        self.lock = threading.Lock()
+        self.data = self.replay()
+        if os.path.exists(self.old_log_path):
+            """ Previous compaction was interrupted, finish it before the old journal can be overwritten """
+            print(f"Finishing interrupted compaction of {self.path}...")
+            self.write_snapshot(json.dumps(self.data))
+            os.remove(self.old_log_path)
+        self.log_file = open(self.log_path, "ab")
+        self.log_size = self.log_file.tell()
+
+    def load(self, data_type: str) -> Any:
+        return self.data.get(data_type)
+
+    def load_prefix(self, prefix: str) -> Dict[str, Any]:
+        with self.lock:
+            return {k: v for k, v in self.data.items() if k.startswith(prefix)}
+
+    def save(self, data_type: str, data: Any):
+        self.save_many({data_type: data})
+
+    def save_many(self, data: Dict[str, Any]) -> int:
+        records = b"".join((json.dumps({"k": k, "v": v}) + "\n").encode() for k, v in data.items())
+        return self.append(records, lambda: self.data.update(data))
+
+    def delete(self, data_type: str):
+        self.delete_many([data_type])
+
+    def delete_many(self, data_types: List[str]):
+        records = b"".join((json.dumps({"k": k, "d": True}) + "\n").encode() for k in data_types)
+
+        def apply():
+            for data_type in data_types:
+                self.data.pop(data_type, None)
+
+        self.append(records, apply)
+
+    def append(self, records: bytes, apply: Callable[[], None]) -> int:
+        """ Makes the journal records durable, then applies them in memory """
+        with self.lock:
+            self.log_file.write(records)
+            self.log_file.flush()
+            os.fsync(self.log_file.fileno())
+            apply()
+            self.log_size += len(records)
+            start_compaction = not self.compacting and self.log_size >= self.compact_threshold
+            if start_compaction:
+                self.compacting = True
+        if start_compaction:
+            threading.Thread(target=self.compact, daemon=True).start()
+        return len(records)
+
+    def replay(self) -> Dict[str, Any]:
+        data = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as file:
+                dat = file.read()
+            if len(dat) > 0:
+                data = json.loads(dat)
+        for log_path in [self.old_log_path, self.log_path]:
+            if os.path.exists(log_path):
+                self.replay_log(log_path, data)
+        return data
+
+    def replay_log(self, log_path: str, data: Dict[str, Any]):
+        valid_size = 0
+        with open(log_path, "rb") as file:
+            for line in file:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("Incomplete record")
+                    record = json.loads(line)
+                except ValueError:
+                    """ Torn write from a crash, everything after the last complete record is dropped """
+                    print(f"Discarding incomplete journal tail of {log_path} at byte {valid_size}")
+                    break
+                if record.get("d"):
+                    data.pop(record["k"], None)
+                else:
+                    data[record["k"]] = record["v"]
+                valid_size += len(line)
+        if valid_size != os.path.getsize(log_path):
+            with open(log_path, "r+b") as file:
+                file.truncate(valid_size)
+
+    def compact(self):
+        """ Folds the journal into the snapshot, saves keep appending to a fresh journal meanwhile """
+        try:
+            with self.lock:
+                snapshot = json.dumps(self.data)
+                self.log_file.close()
+                os.replace(self.log_path, self.old_log_path)
+                self.log_file = open(self.log_path, "ab")
+                self.log_size = 0
+            self.write_snapshot(snapshot)
+            os.remove(self.old_log_path)
+        finally:
+            self.compacting = False
+
+    def write_snapshot(self, snapshot: str):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as file:
+            file.write(snapshot)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+        dir_fd = os.open(os.path.dirname(self.path), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def close(self):
+        with self.lock:
+            self.log_file.close()
+
+
+class SqliteDataSource(DataSource):
+    """
+    Stores tickets, settings and users in their own tables keyed by guild, so a
+    single ticket, user or guild is loaded without reading anything else.
+    Data types that do not map to a table are kept in a plain key-value table.
+    """
+    path: str
+    tables = {
+        "ticket": ("tickets", ["guild_id", "channel_id"]),
+        "settings": ("settings", ["guild_id"]),
+        "user": ("users", ["guild_id", "user_id"]),
+    }
+
+    def __init__(self, file_name: str, migrate_from: str = None):
+        self.path = f"{os.getcwd()}/{file_name}"
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.create_tables()
+        if migrate_from is not None:
+            self.migrate_json(migrate_from)
+
+    def create_tables(self):
+        with self.connection:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS tickets (
+                    guild_id INTEGER NOT NULL,
+                    channel_id INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (guild_id, channel_id)
+                );
+                CREATE TABLE IF NOT EXISTS settings (
+                    guild_id INTEGER PRIMARY KEY,
+                    data TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS users (
+                    guild_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (guild_id, user_id)
+                );
+                CREATE INDEX IF NOT EXISTS users_user_id ON users (user_id);
+                CREATE TABLE IF NOT EXISTS kv (
+                    key TEXT PRIMARY KEY,
+                    data TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+            """)
+
+    def route(self, data_type: str):
+        """ Returns (table, columns, ids) for keys like ticket:{gid}:{cid}, None for the kv table """
+        kind, _, rest = data_type.partition(":")
+        table = self.tables.get(kind)
+        if table is None:
+            return None
+        ids = rest.split(":") if len(rest) > 0 else []
+        if len(ids) > len(table[1]) or not all(i.isdigit() for i in ids):
+            return None
+        return table[0], table[1], [int(i) for i in ids]
+
+    def load(self, data_type: str) -> Any:
+        route = self.route(data_type)
+        with self.lock:
+            if route is not None and len(route[2]) == len(route[1]):
+                table, columns, ids = route
+                where = " AND ".join(f"{c} = ?" for c in columns)
+                row = self.connection.execute(f"SELECT data FROM {table} WHERE {where}", ids).fetchone()
+            else:
+                row = self.connection.execute("SELECT data FROM kv WHERE key = ?", [data_type]).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def load_prefix(self, prefix: str) -> Dict[str, Any]:
+        route = self.route(prefix.rstrip(":")) if prefix.endswith(":") else None
+        with self.lock:
+            if route is not None and len(route[2]) < len(route[1]):
+                table, columns, ids = route
+                kind = prefix.split(":")[0]
+                where = " AND ".join(f"{c} = ?" for c in columns[:len(ids)]) or "1"
+                rows = self.connection.execute(
+                    f"SELECT {', '.join(columns)}, data FROM {table} WHERE {where}", ids).fetchall()
+                return {":".join([kind, *map(str, row[:-1])]): json.loads(row[-1]) for row in rows}
+            rows = self.connection.execute(
+                "SELECT key, data FROM kv WHERE substr(key, 1, ?) = ?", [len(prefix), prefix]).fetchall()
+            return {key: json.loads(data) for key, data in rows}
+
+    def save(self, data_type: str, data: Any):
+        with self.lock, self.connection:
+            self.write(data_type, data)
+
+    def save_many(self, data: Dict[str, Any]) -> int:
+        with self.lock, self.connection:
+            return sum(self.write(data_type, data[data_type]) for data_type in data)
+
+    def delete(self, data_type: str):
+        self.delete_many([data_type])
+
+    def delete_many(self, data_types: List[str]):
+        with self.lock, self.connection:
+            for data_type in data_types:
+                route = self.route(data_type)
+                if route is not None and len(route[2]) == len(route[1]):
+                    table, columns, ids = route
+                    where = " AND ".join(f"{c} = ?" for c in columns)
+                    self.connection.execute(f"DELETE FROM {table} WHERE {where}", ids)
+                else:
+                    self.connection.execute("DELETE FROM kv WHERE key = ?", [data_type])
+
+    def compact(self):
+        with self.lock:
+            self.connection.execute("VACUUM")
+
+    def write(self, data_type: str, data: Any) -> int:
+        dat = json.dumps(data)
+        route = self.route(data_type)
+        if route is not None and len(route[2]) == len(route[1]):
+            table, columns, ids = route
+            self.connection.execute(
+                f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}, data) "
+                f"VALUES ({', '.join('?' for _ in columns)}, ?)",
+                [*ids, dat]
+            )
+        else:
+            self.connection.execute("INSERT OR REPLACE INTO kv (key, data) VALUES (?, ?)", [data_type, dat])
+        return len(dat)
+
+    def migrate_json(self, file_name: str):
+        """ One-shot import of a JsonDataSource/JournaledDataSource file, skipped once done """
+        json_path = f"{os.getcwd()}/{file_name}"
+        with self.lock:
+            migrated = self.connection.execute("SELECT value FROM meta WHERE key = 'migrated_from'").fetchone()
+        if migrated is not None or not os.path.exists(json_path):
+            return
+        if os.path.exists(f"{json_path}.log"):
+            json_source = JournaledDataSource(file_name)
+            all_data = json_source.data
+            json_source.close()
+        else:
+            all_data = JsonDataSource(file_name).data
+        print(f"Migrating {json_path} to {self.path}...")
+        records = 0
+        with self.lock, self.connection:
+            for data_type, data in all_data.items():
+                if data_type == DataTypes.settings:
+                    for guild_id in data:
+                        self.write(DataTypes.guild_settings(int(guild_id)), data[guild_id])
+                        records += 1
+                elif data_type == DataTypes.tickets:
+                    for guild_id in data:
+                        for channel_id in data[guild_id]:
+                            self.write(DataTypes.ticket(int(guild_id), int(channel_id)), data[guild_id][channel_id])
+                            records += 1
+                else:
+                    self.write(data_type, data)
+                    records += 1
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from', ?)", [json_path])
+        print(f"Migrated {records} records!")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def create_data_source(source_type: str) -> DataSource:
+    """ Creates the data source selected with the DATA_SOURCE environment variable """
+    if source_type == "sqlite":
+        return SqliteDataSource("data.db", migrate_from="data.json")
+    if source_type == "journal":
+        return JournaledDataSource("data.json")
+    return JsonDataSource("data.json")
+
+
+# Queued in place of the data of a deleted data type
+DELETED = object()
+
+
+class AsyncDataSource:
+    """
+    Event loop facing wrapper of a DataSource.
+
+    All DataSource calls run on a single worker thread, so they keep their order
+    and never block the loop. Saves are write-behind: they are queued, repeated
+    saves of one data type are coalesced and everything is written in one batch
+    every flush_interval seconds. Loads see queued values.
+
+    Flush hooks run right before every flush and may queue more data with save_nowait.
+    """
+    source: DataSource
+    flush_interval: float
+    pending: Dict[str, Any]
+    flushing: Dict[str, Any]
+    flush_hooks: List[Callable[[], None]]
+
+    # Write volume counters
+    flushes: int
+    records_written: int
+    bytes_written: int
+    last_flush_records: int
+    last_flush_bytes: int
+
+    def __init__(self, data_source: DataSource, flush_interval: float = 1.0):
+        self.source = data_source
+        self.flush_interval = flush_interval
+        self.pending = {}
+        self.flushing = {}
+        self.flush_hooks = []
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="data-source")
+        self.flush_lock = asyncio.Lock()
+        self.flush_task = None
+        self.flushes = 0
+        self.records_written = 0
+        self.bytes_written = 0
+        self.last_flush_records = 0
+        self.last_flush_bytes = 0
+
+    def start(self):
+        if self.flush_task is None and self.flush_interval > 0:
+            self.flush_task = asyncio.get_running_loop().create_task(self.flush_loop())
+
+    async def run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def load(self, data_type: str) -> Any:
+        for queued in [self.pending, self.flushing]:
+            if data_type in queued:
+                data = queued[data_type]
+                return data if data is not DELETED else None
+        return await self.run(self.source.load, data_type)
+
+    async def load_prefix(self, prefix: str) -> Dict[str, Any]:
+        data = await self.run(self.source.load_prefix, prefix)
+        for queued in [self.flushing, self.pending]:
+            data.update({k: v for k, v in queued.items() if k.startswith(prefix)})
+        return {k: v for k, v in data.items() if v is not DELETED}
+
+    def save_nowait(self, data_type: str, data: Any):
+        """ Queues the data for the next flush """
+        self.pending[data_type] = data
+
+    async def save(self, data_type: str, data: Any):
+        self.save_nowait(data_type, data)
+        if self.flush_task is None:
+            await self.flush()
+
+    def delete_nowait(self, data_type: str):
+        self.pending[data_type] = DELETED
+
+    async def delete(self, data_type: str):
+        self.delete_nowait(data_type)
+        if self.flush_task is None:
+            await self.flush()
+
+    def write_batch(self, batch: Dict[str, Any]) -> int:
+        saved = {k: v for k, v in batch.items() if v is not DELETED}
+        deleted = [k for k, v in batch.items() if v is DELETED]
+        written = 0
+        if len(saved) > 0:
+            written = self.source.save_many(saved) or 0
+        if len(deleted) > 0:
+            self.source.delete_many(deleted)
+        return written
+
+    async def flush(self):
+        async with self.flush_lock:
+            for hook in self.flush_hooks:
+                hook()
+            if len(self.pending) == 0:
+                return
+            self.flushing, self.pending = self.pending, {}
+            try:
+                written = await self.run(self.write_batch, self.flushing)
+            except Exception:
+                """ Keep the batch queued for the next flush, newer saves win """
+                for data_type in self.flushing:
+                    self.pending.setdefault(data_type, self.flushing[data_type])
+                raise
+            else:
+                self.flushes += 1
+                self.last_flush_records = len(self.flushing)
+                self.last_flush_bytes = written
+                self.records_written += self.last_flush_records
+                self.bytes_written += self.last_flush_bytes
+            finally:
+                self.flushing = {}
+
+    async def flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                traceback.print_exc()
+
+    async def close(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        await self.flush()
+        close_func = getattr(self.source, "close", None)
+        if close_func is not None:
+            await self.run(close_func)
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,98 @@
+from array import array
+from typing import Any, Dict, Iterator, List, Optional
+
+import client  # Loads ticket through client, importing ticket first is circular
+from ticket import Ticket, categories, ticket_from_data
+
+# Category column values, index into ticket.categories
+category_indexes: Dict[str, int] = {category.lc_name: i for i, category in enumerate(categories)}
+no_category = 0xFFFF
+
+
+class TicketTable:
+    """
+    Column storage of ticket records for bulk processing. Numeric fields are kept
+    in typed arrays, the category as an index into ticket.categories, so a row
+    costs a few dozen bytes plus its title and description. select() scans the
+    columns without creating Ticket objects, ticket() materializes one row.
+    """
+    __slots__ = (
+        "guild_ids", "channel_ids", "author_ids", "categories", "is_open", "created_at", "updated_at",
+        "titles", "descriptions", "persistent"
+    )
+    guild_ids: array
+    channel_ids: array
+    author_ids: array
+    categories: array
+    is_open: array
+    created_at: array
+    updated_at: array
+    titles: List[str]
+    descriptions: List[str]
+    persistent: Dict[int, Dict[str, Any]]  # Row -> persistent data, only rows that have any
+
+    def __init__(self):
+        self.guild_ids = array("q")
+        self.channel_ids = array("q")
+        self.author_ids = array("q")
+        self.categories = array("H")
+        self.is_open = array("b")
+        self.created_at = array("d")
+        self.updated_at = array("d")
+        self.titles = []
+        self.descriptions = []
+        self.persistent = {}
+
+    def __len__(self):
+        return len(self.channel_ids)
+
+    def append_data(self, guild_id: int, data: Dict[str, Any]) -> int:
+        """ Appends a ticket record as stored by ticket_to_data, returns its row """
+        row = len(self)
+        self.guild_ids.append(guild_id)
+        self.channel_ids.append(int(data["channel_id"]))
+        self.author_ids.append(int(data["author_id"]))
+        self.categories.append(category_indexes.get(data["category"], no_category))
+        self.is_open.append(1 if data.get("is_open", True) else 0)
+        self.created_at.append(data.get("created_at") or 0.0)
+        self.updated_at.append(data.get("updated_at") or data.get("created_at") or 0.0)
+        self.titles.append(data["title"])
+        self.descriptions.append(data["description"])
+        if data.get("persistent_data"):
+            self.persistent[row] = data["persistent_data"]
+        return row
+
+    def select(self,
+               guild_id: Optional[int] = None,
+               author_id: Optional[int] = None,
+               is_open: Optional[bool] = None,
+               updated_before: Optional[float] = None) -> Iterator[int]:
+        """ Rows matching all given filters """
+        for row in range(len(self)):
+            if guild_id is not None and self.guild_ids[row] != guild_id:
+                continue
+            if author_id is not None and self.author_ids[row] != author_id:
+                continue
+            if is_open is not None and bool(self.is_open[row]) != is_open:
+                continue
+            if updated_before is not None and self.updated_at[row] >= updated_before:
+                continue
+            yield row
+
+    def to_data(self, row: int) -> Dict[str, Any]:
+        category = self.categories[row]
+        return {
+            "guild_id": self.guild_ids[row],
+            "channel_id": self.channel_ids[row],
+            "author_id": self.author_ids[row],
+            "category": categories[category].lc_name if category != no_category else None,
+            "title": self.titles[row],
+            "description": self.descriptions[row],
+            "is_open": bool(self.is_open[row]),
+            "persistent_data": dict(self.persistent.get(row) or {}),
+            "created_at": self.created_at[row],
+            "updated_at": self.updated_at[row]
+        }
+
+    def ticket(self, client: Any, row: int) -> Ticket:
+        return ticket_from_data(client, self.guild_ids[row], self.to_data(row))
@@ -1,15 +1,24 @@
-from typing import Any, Dict
+import sys
+import time
+import asyncio
+from typing import Any, Dict, Optional
 
 import discord
-from discord import Embed
+from discord import Embed, NotFound
 
 import event
 import settings
 import client
 import random
+from scheduler import Priority, OperationStats
+
+
+# Chat activity only updates updated_at in memory, it is saved once it is this many seconds newer
+activity_save_interval = 15 * 60
 
 
 class Category:
+    __slots__ = ("name", "lc_name", "description", "long_desc")
     name: str
     lc_name: str  # ID
     description: str
@@ -21,50 +30,99 @@ class Category:
                  description: str,
                  long_desc: str):
         self.name = name
-        self.lc_name = lc_name
+        self.lc_name = sys.intern(lc_name)
         self.description = description
         self.long_desc = long_desc
 
 
 class Ticket:
+    __slots__ = (
+        "client", "guild_id", "channel_id", "author_id", "category", "title", "description", "is_open",
+        "persistent", "created_at", "updated_at", "saved_at", "dirty", "welcome_message"
+    )
     client: Any  # TicketBot
+    guild_id: int
     channel_id: int
     author_id: int
     category: Category
     title: str
     description: str
     is_open: bool
-    persistent: Dict[str, Any]
+    persistent: Optional[Dict[str, Any]]  # None until something is stored
+    created_at: float  # Unix timestamps
+    updated_at: float
+    saved_at: float  # updated_at as of the last save
+    dirty: bool  # Changed since the last save
+    welcome_message: Optional[discord.PartialMessage]
 
     def __init__(
             self,
             client: Any,
+            guild_id: int,
             channel_id: int,
             author_id: int,
             category: Category,
             title: str,
             description: str,
             is_open: bool = True,
-            persistent=None
+            persistent=None,
+            created_at: float = None,
+            updated_at: float = None
     ):
         self.client = client
+        self.guild_id = guild_id
         self.channel_id = channel_id
         self.author_id = author_id
         self.category = category
         self.title = title
         self.description = description
         self.is_open = is_open
-        self.persistent = persistent or {}
+        self.persistent = persistent or None
+        self.created_at = created_at or time.time()
+        self.updated_at = updated_at or self.created_at
+        self.saved_at = self.updated_at
+        self.dirty = False
+        self.welcome_message = None
+
+    def mark_dirty(self):
+        """ Schedules this ticket to be written on the next data flush """
+        if not self.dirty:
+            self.dirty = True
+            self.client.dirty_tickets.add(self)
+
+    def touch(self):
+        """ Records a state change, re-indexes the ticket and schedules it to be written """
+        self.updated_at = time.time()
+        self.client.tickets.update(self)
+        self.mark_dirty()
+
+    def record_activity(self):
+        """ Records chat activity in memory, it is written at most every activity_save_interval seconds """
+        self.updated_at = time.time()
+        self.client.tickets.touch(self)
+        if self.updated_at - self.saved_at >= activity_save_interval:
+            self.mark_dirty()
+
+    def get_persistent(self, key: str, default: Any = None) -> Any:
+        return self.persistent.get(key, default) if self.persistent is not None else default
+
+    def set_persistent(self, key: str, value: Any):
+        if self.persistent is None:
+            self.persistent = {}
+        self.persistent[key] = value
+        self.mark_dirty()
 
     async def fetch_channel(self) -> discord.TextChannel:
-        return await self.client.fetch_channel(self.channel_id)
+        """ Resolves the channel from cache, fetching it only on a miss """
+        return await self.client.resolver.channel(self.channel_id)
 
     async def fetch_author(self):
         return await self.client.fetch_user(self.author_id)
 
-    async def send_welcome_message(self):
+    async def send_welcome_message(self, is_open: Optional[bool] = None, priority: Priority = Priority.user):
+        """ Sends or updates the welcome message, is_open overrides the shown status """
         channel = await self.fetch_channel()
-        if self.is_open:
+        if (is_open if is_open is not None else self.is_open):
             status = "Open"
         else:
             status = "Closed"
@@ -76,12 +134,14 @@ class Ticket:
         embed.add_field(name="Problem", value=self.title, inline=False)
         embed.add_field(name="Problem Description", value=self.description, inline=False)
         embed.add_field(name="Status", value=status, inline=True)
-        if self.persistent.get("welcome_message_id") is not None:
-            old_message = await channel.fetch_message(int(self.persistent.get("welcome_message_id")))
-            await old_message.edit(embed=embed)
+        if self.get_persistent("welcome_message_id") is not None:
+            if self.welcome_message is None:
+                self.welcome_message = channel.get_partial_message(int(self.get_persistent("welcome_message_id")))
+            await self.client.rest.submit(self.guild_id, self.welcome_message.edit, priority=priority, embed=embed)
         else:
-            new_message = await channel.send(embed=embed)
-            self.persistent["welcome_message_id"] = str(new_message.id)
+            new_message = await self.client.rest.submit(self.guild_id, channel.send, priority=priority, embed=embed)
+            self.welcome_message = channel.get_partial_message(new_message.id)
+            self.set_persistent("welcome_message_id", str(new_message.id))
 
     async def reopen(self):
         await self.change_open_state(open_state=True)
@@ -89,72 +149,105 @@ class Ticket:
     async def close(self):
         await self.change_open_state(open_state=False)
 
-    async def change_open_state(self, open_state: bool):
+    async def change_open_state(self, open_state: bool, priority: Priority = Priority.state):
+        """
+        Moves the ticket channel and changes the author permissions in a single
+        channel edit, the welcome message is updated at the same time and put
+        back to the unchanged state if the edit fails. Tickets of authors who
+        left the guild change state without the author overwrite.
+        """
         if self.is_open == open_state:
             return
-        bot_client: client.TicketBot = self.client
-        channel: discord.TextChannel = await self.fetch_channel()
-        author: discord.Member = channel.guild.get_member(self.author_id)
-        guild_settings: settings.GuildSettings = bot_client.get_guild_settings(channel.guild)
-        if open_state:
-            new_name = f"{self.category.lc_name}-{author.name}-{random.randint(0, 999)}"
-            new_category_channel_id = guild_settings.tickets_category
-            event_call = event.EventTypes.ticket_reopen
-            overwrites = self.open_overwrites(overwrites=channel.overwrites_for(author))
-        else:
-            new_name = f"closed-{author.name}-{random.randint(0, 999)}"
-            new_category_channel_id = guild_settings.closed_tickets_category
-            event_call = event.EventTypes.ticket_close
-            overwrites = await self.close_overwrites(author)
-        await channel.set_permissions(target=author, overwrite=overwrites)
-        await channel.edit(
-            name=new_name,
-            category=await bot_client.fetch_channel(new_category_channel_id)
-        )
-        self.client.save_tickets()
-        await self.send_welcome_message()
-        self.is_open = open_state
-        await self.client.events.call(event_call, {"ticket": self, "channel": channel, "author": author})
+        with transition_stats.measure():
+            bot_client: client.TicketBot = self.client
+            channel: discord.TextChannel = await self.fetch_channel()
+            author: Optional[discord.Member]
+            try:
+                author = await bot_client.resolver.member(channel.guild, self.author_id)
+            except NotFound:
+                author = None
+            author_name = author.name if author is not None else str(self.author_id)
+            guild_settings: settings.GuildSettings = await bot_client.get_guild_settings(channel.guild)
+            overwrites = dict(channel.overwrites)
+            if open_state:
+                new_name = f"{self.category.lc_name}-{author_name}-{random.randint(0, 999)}"
+                new_category_channel_id = guild_settings.tickets_category
+                event_call = event.EventTypes.ticket_reopen
+                if author is not None:
+                    overwrites[author] = self.open_overwrites(overwrites=channel.overwrites_for(author))
+            else:
+                new_name = f"closed-{author_name}-{random.randint(0, 999)}"
+                new_category_channel_id = guild_settings.closed_tickets_category
+                event_call = event.EventTypes.ticket_close
+                if author is not None:
+                    overwrites[author] = self.close_overwrites(channel, author)
+            new_category = await bot_client.resolver.channel(new_category_channel_id, channel.guild)
+            edit_result, welcome_result = await asyncio.gather(
+                bot_client.rest.submit(
+                    self.guild_id, channel.edit, priority=priority, coalesce_key=("edit", channel.id),
+                    name=new_name, category=new_category, overwrites=overwrites
+                ),
+                self.send_welcome_message(is_open=open_state, priority=priority),
+                return_exceptions=True
+            )
+            if isinstance(edit_result, Exception):
+                if not isinstance(welcome_result, Exception):
+                    try:
+                        await self.send_welcome_message(is_open=self.is_open, priority=priority)
+                    except Exception as e:
+                        print(f"Failed to restore welcome message of ticket {self.channel_id}: {e!r}")
+                raise edit_result
+            if isinstance(welcome_result, Exception):
+                print(f"Failed to update welcome message of ticket {self.channel_id}: {welcome_result!r}")
+            self.is_open = open_state
+            self.touch()
+        await self.client.events.emit(event_call, {"ticket": self, "channel": channel, "author": author})
 
-    def open_overwrites(self, overwrites: discord.PermissionOverwrite) -> discord.PermissionOverwrite:
+    @staticmethod
+    def open_overwrites(overwrites: discord.PermissionOverwrite) -> discord.PermissionOverwrite:
         overwrites.view_channel = True
         overwrites.send_messages = True
         return overwrites
 
-    async def close_overwrites(self, member: discord.Member) -> discord.PermissionOverwrite:
-        channel = await self.fetch_channel()
+    @staticmethod
+    def close_overwrites(channel: discord.TextChannel, member: discord.Member) -> discord.PermissionOverwrite:
         return channel.overwrites_for(member.top_role)
 
 
-def ticket_from_data(client: discord.Client, data) -> Ticket:
-    categories_query = [c for c in categories if c.lc_name == data["category"]]
-    category: Any
-    if len(categories_query) > 0:
-        category = categories_query.pop()
-    else:
-        category = None
+def get_category(lc_name: str):
+    return categories_by_name.get(lc_name)
+
+
+def ticket_from_data(client: discord.Client, guild_id: int, data) -> Ticket:
+    category = get_category(data["category"])
 
     return Ticket(
         client=client,
-        channel_id=data["channel_id"],
+        guild_id=guild_id,
+        channel_id=int(data["channel_id"]),
         author_id=data["author_id"],
         category=category,
         title=data["title"],
         description=data["description"],
-        is_open=data.get("is_open") or True,
-        persistent=data.get("persistent_data")
+        is_open=data.get("is_open", True),
+        persistent=data.get("persistent_data"),
+        created_at=data.get("created_at"),
+        updated_at=data.get("updated_at")
     )
 
 
 def ticket_to_data(ticket: Ticket) -> Any:
     data = {
+        "guild_id": ticket.guild_id,
         "channel_id": ticket.channel_id,
         "author_id": ticket.author_id,
         "category": ticket.category.lc_name,
         "title": ticket.title,
         "description": ticket.description,
         "is_open": ticket.is_open,
-        "persistent_data": ticket.persistent
+        "persistent_data": dict(ticket.persistent or {}),
+        "created_at": ticket.created_at,
+        "updated_at": ticket.updated_at
     }
     return data
 
@@ -165,3 +258,7 @@ categories = [
              description="General Questions category",
              long_desc="Long Description about this category")
 ]
+categories_by_name: Dict[str, Category] = {c.lc_name: c for c in categories}
+
+# REST calls and wall time of close and reopen
+transition_stats = OperationStats("ticket state transition")
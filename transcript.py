@@ -0,0 +1,128 @@
+import os
+import gzip
+import json
+import asyncio
+import traceback
+from typing import Any, Dict, List, Optional, Tuple
+
+import discord
+from discord import NotFound
+
+import source
+
+
+def message_to_data(message: discord.Message) -> Dict[str, Any]:
+    return {
+        "id": message.id,
+        "author_id": message.author.id,
+        "author": str(message.author),
+        "created_at": message.created_at.isoformat(),
+        "content": message.content,
+        "attachments": [attachment.url for attachment in message.attachments],
+        "embeds": [embed.to_dict() for embed in message.embeds]
+    }
+
+
+def append_page(path: str, offset: int, page: List[Dict[str, Any]]) -> int:
+    """ Appends the page as one gzip member at offset, dropping anything after it, returns the new file size """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "r+b" if os.path.exists(path) else "wb") as file:
+        file.truncate(offset)
+        file.seek(offset)
+        file.write(gzip.compress(b"".join((json.dumps(data) + "\n").encode() for data in page)))
+        file.flush()
+        os.fsync(file.fileno())
+        return file.tell()
+
+
+class TranscriptExporter:
+    """
+    Exports ticket channel histories to gzip compressed JSONL files at
+    directory/{guild_id}/{channel_id}.jsonl.gz, readable with gzip.open.
+
+    The history is streamed oldest first and written every page_size messages as
+    a separate gzip member, so memory does not grow with the channel. After every
+    page the last written message ID and the file size are stored as
+    transcript:{guild_id}:{channel_id}. An interrupted export drops anything past
+    the stored size and continues after the stored message, and exporting a
+    ticket again only appends the newer messages. At most concurrency exports
+    read history at once.
+    """
+    client: Any  # TicketBot
+    directory: str
+    page_size: int
+    semaphore: asyncio.Semaphore
+    running: Dict[Tuple[int, int], asyncio.Task]
+    exported: int  # Messages written
+
+    def __init__(self, client, directory: str = "transcripts", concurrency: int = 2, page_size: int = 100):
+        self.client = client
+        self.directory = directory
+        self.page_size = page_size
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.running = {}
+        self.exported = 0
+
+    def path(self, guild_id: int, channel_id: int) -> str:
+        return os.path.join(self.directory, str(guild_id), f"{channel_id}.jsonl.gz")
+
+    def start(self, guild_id: int, channel_id: int) -> asyncio.Task:
+        """ Exports in the background, returns the running export of the ticket if there is one """
+        task = self.running.get((guild_id, channel_id))
+        if task is None:
+            task = asyncio.ensure_future(self.export(guild_id, channel_id))
+            self.running[(guild_id, channel_id)] = task
+            task.add_done_callback(lambda _: self.running.pop((guild_id, channel_id), None))
+        return task
+
+    async def resume_pending(self):
+        """ Restarts exports interrupted by a shutdown or crash """
+        states = await self.client.data_source.load_prefix(source.DataTypes.transcripts)
+        for data_type, state in states.items():
+            if state.get("running"):
+                _, guild_id, channel_id = data_type.split(":")
+                self.start(int(guild_id), int(channel_id))
+
+    async def stop(self):
+        tasks = list(self.running.values())
+        [task.cancel() for task in tasks]
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def export(self, guild_id: int, channel_id: int) -> Optional[Dict[str, Any]]:
+        data_type = source.DataTypes.transcript(guild_id, channel_id)
+        path = self.path(guild_id, channel_id)
+        async with self.semaphore:
+            state = await self.client.data_source.load(data_type)
+            if state is None or not os.path.exists(path) or os.path.getsize(path) < state["size"]:
+                state = {"last_message_id": None, "size": 0, "messages": 0}
+            state["running"] = True
+            await self.client.data_source.save(data_type, dict(state))
+            try:
+                channel = await self.client.resolver.channel(channel_id)
+                after = discord.Object(id=state["last_message_id"]) if state["last_message_id"] else None
+                page = []
+                async for message in channel.history(limit=None, after=after, oldest_first=True):
+                    page.append(message_to_data(message))
+                    if len(page) >= self.page_size:
+                        await self.write_page(data_type, path, state, page)
+                        page = []
+                if len(page) > 0:
+                    await self.write_page(data_type, path, state, page)
+            except NotFound:
+                print(f"Transcript of {channel_id} stopped, channel no longer exists")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                print(f"Failed to export transcript of {channel_id}:")
+                traceback.print_exc()
+                return None
+            state["running"] = False
+            await self.client.data_source.save(data_type, dict(state))
+        return state
+
+    async def write_page(self, data_type: str, path: str, state: Dict[str, Any], page: List[Dict[str, Any]]):
+        state["size"] = await asyncio.get_running_loop().run_in_executor(None, append_page, path, state["size"], page)
+        state["last_message_id"] = page[-1]["id"]
+        state["messages"] += len(page)
+        self.exported += len(page)
+        await self.client.data_source.save(data_type, dict(state))
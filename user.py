@@ -1,3 +1,7 @@
+import sys
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Tuple
+
 import discord
 
 import source
@@ -6,12 +10,17 @@ permissions = {
     "admin_panel": {"name": "Use Admin Panel"},
     "user_panel": {"name": "Use User Panel"},
     "user_panel_groups": {"name": "Set user a group through panel"},
+    "roles_manage": {"name": "Manage custom roles"},
     "admin_setup": {"name": "Use Admin Setup"},
     "ticket_panel": {"name": "Use Ticket Admin"},
     "sync_commands": {"name": "Synchronize Commands"},
-    "reload": {"name": "Reload bot on current guild"}
+    "reload": {"name": "Reload bot on current guild"},
+    "bulk_manage": {"name": "Close, reopen and delete many tickets at once"}
 }
 
+# Bit of every permission in compiled permission masks
+permission_bits: Dict[str, int] = {perm: 1 << i for i, perm in enumerate(permissions)}
+
 roles = {
     "default": {
         "name": "Default Role",
@@ -24,53 +33,173 @@ roles = {
 }
 
 
-def user(d_source: source.DataSource, guild_id: int, user_id: int):
-    data = d_source.load(source.DataTypes.user(guild_id, user_id))
-    created = False
+# Called with the TicketUser whenever its role changes
+role_change_hooks: List[Callable[[Any], None]] = []
+
+
+default_role_id = "default"
+
+
+@lru_cache(maxsize=None)
+def compile_perms(perms: Tuple[str, ...]) -> int:
+    """ Compiles permission names into a bitmask """
+    mask = 0
+    for perm in perms:
+        bit = permission_bits.get(perm)
+        if bit is None:
+            raise ValueError(f"Permission {perm} does not exist!")
+        mask |= bit
+    return mask
+
+
+class Role:
+    id: str
+    name: str
+    perms: List[str]
+    mask: int
+    discord_roles: List[int]  # Discord roles that grant this role
+
+    def __init__(self, role_id: str, data):
+        self.id = role_id
+        self.name = data.get("name")
+        self.perms = list(data.get("perms") or [])
+        self.mask = compile_perms(tuple(self.perms))
+        self.discord_roles = [int(r) for r in data.get("discord_roles") or []]
+
+    def to_data(self):
+        return {
+            "name": self.name,
+            "perms": self.perms,
+            "discord_roles": self.discord_roles
+        }
+
+
+builtin_roles: Dict[str, Role] = {role_id: Role(role_id, data) for role_id, data in roles.items()}
+
+
+async def guild_roles(d_source: source.AsyncDataSource, guild_id: int):
+    data = await d_source.load(source.DataTypes.guild_roles(guild_id)) or {}
+    return GuildRoles(guild_id, data)
+
+
+class GuildRoles:
+    """ Built-in roles plus custom roles of a guild, kept compiled """
+    guild_id: int
+    custom: Dict[str, Role]
+    discord_masks: Dict[int, int]  # Discord role ID -> mask of roles it grants
+
+    def __init__(self, guild_id: int, data):
+        self.guild_id = guild_id
+        self.custom = {role_id: Role(role_id, role_data) for role_id, role_data in data.items()}
+        self.discord_masks = {}
+        self.compile_discord_masks()
+
+    def compile_discord_masks(self):
+        discord_masks = {}
+        for role in [*builtin_roles.values(), *self.custom.values()]:
+            for discord_role_id in role.discord_roles:
+                discord_masks[discord_role_id] = discord_masks.get(discord_role_id, 0) | role.mask
+        self.discord_masks = discord_masks
+
+    def get(self, role_id: str):
+        return self.custom.get(role_id) or builtin_roles.get(role_id)
+
+    def member_mask(self, member: discord.Member) -> int:
+        """ Mask granted by member's discord roles """
+        if len(self.discord_masks) == 0:
+            return 0
+        mask = 0
+        for discord_role in getattr(member, "roles", []):
+            mask |= self.discord_masks.get(discord_role.id, 0)
+        return mask
+
+    def set_role(self, role_id: str, name: str, perms: List[str]) -> Role:
+        """ Creates or edits a custom role """
+        if role_id in builtin_roles:
+            raise ValueError("Built-in roles can't be modified!")
+        existing = self.custom.get(role_id)
+        discord_roles = existing.discord_roles if existing is not None else []
+        role = Role(role_id, {"name": name, "perms": perms, "discord_roles": discord_roles})
+        self.custom[role_id] = role
+        self.compile_discord_masks()
+        return role
+
+    def delete_role(self, role_id: str):
+        if self.custom.pop(role_id, None) is None:
+            raise ValueError("Provided role does not exist!")
+        self.compile_discord_masks()
+
+    def bind_discord_role(self, role_id: str, discord_role_id: int, bind: bool = True):
+        role = self.custom.get(role_id)
+        if role is None:
+            raise ValueError("Provided role does not exist!")
+        if bind and discord_role_id not in role.discord_roles:
+            role.discord_roles.append(discord_role_id)
+        elif not bind and discord_role_id in role.discord_roles:
+            role.discord_roles.remove(discord_role_id)
+        self.compile_discord_masks()
+
+    async def save(self, d_source: source.AsyncDataSource):
+        data = {role_id: role.to_data() for role_id, role in self.custom.items()}
+        await d_source.save(source.DataTypes.guild_roles(self.guild_id), data)
+
+
+async def user(d_source: source.AsyncDataSource, guild_id: int, user_id: int, roles_inst: GuildRoles = None):
+    """ Only users with a non-default role are stored, a missing record means the default role """
+    data = await d_source.load(source.DataTypes.user(guild_id, user_id))
     if data is None:
         data = {
-            "role_id": "default"
+            "role_id": default_role_id
         }
-        created = True
-    user_inst = TicketUser(guild_id, user_id, data)
-    if created:
-        user_inst.save(d_source)
-
-    return user_inst
+    return TicketUser(guild_id, user_id, data, roles_inst or GuildRoles(guild_id, {}))
 
 
 class TicketUser:
+    __slots__ = ("guild_id", "id", "role_id", "roles")
     guild_id: int
     id: int
     role_id: str
+    roles: GuildRoles
 
-    def __init__(self, guild_id: int, user_id: int, data):
+    def __init__(self, guild_id: int, user_id: int, data, roles_inst: GuildRoles):
         self.guild_id = guild_id
         self.id = user_id
-        self.role_id = data.get("role_id")
+        self.role_id = sys.intern(data.get("role_id") or default_role_id)
+        self.roles = roles_inst
 
-    def save(self, d_source: source.DataSource):
+    async def save(self, d_source: source.AsyncDataSource):
+        data_type = source.DataTypes.user(self.guild_id, self.id)
+        if self.role_id == default_role_id:
+            await d_source.delete(data_type)
+            return
         data = {
             "role_id": self.role_id
         }
-        d_source.save(source.DataTypes.user(self.guild_id, self.id), data)
+        await d_source.save(data_type, data)
 
     def set_role(self, role_id):
-        role = roles.get(role_id)
+        role = self.roles.get(role_id)
         if role is None:
             raise ValueError("Provided role does not exist!")
         self.role_id = role_id
+        [hook(self) for hook in role_change_hooks]
         return role
 
-    def get_role(self):
-        return roles.get(self.role_id)
+    def get_role(self) -> Role:
+        """ Deleted custom roles fall back to the default role """
+        return self.roles.get(self.role_id) or builtin_roles[default_role_id]
+
+    def has_perms(self, member: discord.Member, perms) -> bool:
+        required = compile_perms(tuple(perms))
+        mask = self.get_role().mask | self.roles.member_mask(member)
+        return required & ~mask == 0
 
     async def handle_restricted_interaction(self,
                                             interaction: discord.Interaction,
                                             perms,
                                             handler):
         is_admin = interaction.user.guild_permissions.administrator
-        if not is_admin and any(map(lambda p: p not in self.get_role().perms, perms)):
+        if not is_admin and not self.has_perms(interaction.user, perms):
             await interaction.response.send_message(
                 embed=discord.Embed(
                     color=discord.Color.red(),